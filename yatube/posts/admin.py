@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Group, Post
+from .search import matching
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -8,6 +9,14 @@ class PostAdmin(admin.ModelAdmin):
     search_fields = ("text", )
     list_filter = ("pub_date", )
     empty_value_display = "-пусто-"
+    # почти такая же картинка, загруженная раньше, см. PostForm
+    readonly_fields = ("repost_of", )
+
+    def get_search_results(self, request, queryset, search_term):
+        # поиск по индексу FTS5 вместо LIKE '%...%' по всей таблице
+        if not search_term:
+            return queryset, False
+        return matching(queryset, search_term), False
 
 
 class GroupAdmin(admin.ModelAdmin):
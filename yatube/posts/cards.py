@@ -0,0 +1,73 @@
+"""Кэш отрендеренных карточек постов.
+
+HTML карточки (post_item.html) не зависит от зрителя, поэтому
+кэшируется по ключу из id поста, его версии (Post.version растёт при
+правке поста и комментариях) и хэша шаблонов. Кнопки автора хранятся
+в том же значении кэша отдельно и подставляются в карточку заменой
+строки, так что страница ленты стоит один get_many к кэшу.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from .thumbnails import preload
+
+CARD_TEMPLATE = 'post_item.html'
+CARD_THUMBNAIL = 'card'
+OWNER_TEMPLATE = 'misc/owner_buttons.html'
+CARD_CACHE_TIMEOUT = getattr(settings, 'CARD_CACHE_TIMEOUT', 60 * 60 * 24)
+OWNER_SLOT = mark_safe('<!-- owner-buttons -->')
+
+
+@lru_cache(maxsize=None)
+def template_hash():
+    """Меняется при правке шаблонов карточки, старые ключи не читаются."""
+    digest = hashlib.md5()
+    for name in (CARD_TEMPLATE, OWNER_TEMPLATE):
+        digest.update(get_template(name).template.source.encode())
+    return digest.hexdigest()[:8]
+
+
+def card_key(post, is_index, from_post_view):
+    variant = f'{int(bool(is_index))}{int(bool(from_post_view))}'
+    return f'card:{post.id}:{post.version}:{template_hash()}:{variant}'
+
+
+def render_card(post, is_index, from_post_view):
+    """Рендерит карточку без учёта зрителя и кнопки автора к ней."""
+    context = {'post': post,
+               'is_index': is_index,
+               'owner_slot': OWNER_SLOT}
+    if from_post_view:
+        context['from_post_view'] = from_post_view
+    return (render_to_string(CARD_TEMPLATE, context),
+            render_to_string(OWNER_TEMPLATE, {'post': post}))
+
+
+def render_cards(posts, user, is_index=False, from_post_view=False):
+    """HTML карточек постов для зрителя user."""
+    keys = {post.id: card_key(post, is_index, from_post_view)
+            for post in posts}
+    cached = cache.get_many(keys.values())
+    # превью для несобранных карточек - одним запросом к хранилищу sorl
+    preload([post for post in posts if keys[post.id] not in cached],
+            CARD_THUMBNAIL)
+    missing = {}
+    html = []
+    for post in posts:
+        card = cached.get(keys[post.id])
+        if card is None:
+            card = missing[keys[post.id]] = render_card(
+                post, is_index, from_post_view
+            )
+        body, owner_buttons = card
+        if user is not None and user.pk == post.author_id:
+            body = body.replace(OWNER_SLOT, owner_buttons, 1)
+        html.append(body)
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+    return mark_safe(''.join(html))
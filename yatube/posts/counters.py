@@ -0,0 +1,29 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным UPDATE ... SET n = n + delta в той же
+транзакции, что и запись (ATOMIC_REQUESTS), поэтому страницам профиля
+и поста не нужны агрегатные запросы. Если строки счётчиков ещё нет,
+её создаст UserStats.for_user при первом чтении, уже с верными
+значениями, а команда recount_stats пересчитывает всё пакетами.
+"""
+from django.db.models import F
+
+from .models import Post, UserStats
+
+
+def bump_user(user_id, field, delta):
+    UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta}
+    )
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F('comment_count') + delta,
+        version=F('version') + 1,
+    )
+
+
+def bump_version(posts):
+    """Сбрасывает закэшированные карточки постов выборки."""
+    posts.update(version=F('version') + 1)
@@ -0,0 +1,118 @@
+"""Перцептивный хэш картинки (dHash) для поиска почти одинаковых копий.
+
+Картинка сводится к серой 9x8, и каждый из 64 битов хэша - знак разности
+соседних пикселей строки. Пересжатие, смена размера и формата меняют
+лишь несколько битов, поэтому копии одной картинки отличаются на малое
+расстояние Хэмминга.
+
+У однотонной картинки или белого листа с одной строкой текста почти все
+биты хэша одинаковы, и такие хэши близки у совсем разных картинок:
+informative() отсекает их. Совпадение хэшей - только повод сравнить
+сами картинки (same_picture), уменьшенные до одного размера.
+
+Для поиска без перебора всех хэшей (multi-index hashing) хэш делится на
+BANDS частей, каждая хранится в своей индексированной колонке: у хэшей
+на расстоянии меньше BANDS хотя бы одна часть совпадает точно, и
+кандидатов находит обычный поиск по индексу.
+"""
+from PIL import Image, ImageChops, ImageOps, ImageStat
+
+from .placeholders import EXIF_ORIENTATION, ROTATED
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+MASK = (1 << HASH_BITS) - 1
+# хэш, в котором единиц или нулей меньше, - почти без деталей
+MIN_BITS = 4
+# длинная сторона картинок при сравнении; пересжатие меняет яркость
+# пикселя не больше чем на MAX_PIXEL_DIFFERENCE (подпись или пятно - почти
+# на 255), а цвет в среднем не больше чем на MAX_COLOR_DIFFERENCE
+COMPARE_SIZE = 64
+MAX_PIXEL_DIFFERENCE = 48
+MAX_COLOR_DIFFERENCE = 8
+
+
+def dhash(image):
+    """64-битный dHash открытой картинки PIL, со знаком, как BigInteger."""
+    if image.format == 'JPEG':
+        image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    image = ImageOps.exif_transpose(image)
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE),
+                                      Image.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + column]
+            value = value << 1 | (left > pixels[row * (HASH_SIZE + 1)
+                                                + column + 1])
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def hash_file(file):
+    """(dHash, ширина, высота) картинки из файла или None."""
+    try:
+        image = Image.open(file)
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in ROTATED:
+            width, height = height, width
+        value = dhash(image)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        file.seek(0)
+    return value, width, height
+
+
+def bands(value):
+    """Части хэша для индексированных колонок, младшие биты первыми."""
+    value &= MASK
+    band_mask = (1 << BAND_BITS) - 1
+    return [value >> (band * BAND_BITS) & band_mask
+            for band in range(BANDS)]
+
+
+def hamming(first, second):
+    return bin((first ^ second) & MASK).count('1')
+
+
+def informative(value):
+    """Достаточно ли в хэше деталей, чтобы искать по нему копии."""
+    ones = bin(value & MASK).count('1')
+    return MIN_BITS <= ones <= HASH_BITS - MIN_BITS
+
+
+def open_rgb(file):
+    image = Image.open(file)
+    if image.format == 'JPEG':
+        # JPEG декодируется сразу уменьшенным, но не меньше двойного
+        # размера сравнения
+        image.draft('RGB', (COMPARE_SIZE * 2, COMPARE_SIZE * 2))
+    return ImageOps.exif_transpose(image).convert('RGB')
+
+
+def same_picture(first, second):
+    """Одна ли картинка в двух файлах: обе уменьшаются до размера
+    меньшей (не больше COMPARE_SIZE) и сравниваются попиксельно."""
+    try:
+        images = [open_rgb(file) for file in (first, second)]
+        width, height = min((image.size for image in images),
+                            key=lambda size: size[0] * size[1])
+        scale = min(1, COMPARE_SIZE / max(width, height))
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        first_small, second_small = (image.resize(size, Image.BOX)
+                                     for image in images)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return False
+    finally:
+        first.seek(0)
+        second.seek(0)
+    _, brightness = ImageChops.difference(first_small.convert('L'),
+                                          second_small.convert('L')
+                                          ).getextrema()
+    color = ImageStat.Stat(ImageChops.difference(first_small,
+                                                 second_small)).mean
+    return (brightness <= MAX_PIXEL_DIFFERENCE
+            and max(color) <= MAX_COLOR_DIFFERENCE)
@@ -0,0 +1,85 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Новый пост автора сразу раскладывается в ленты его подписчиков,
+поэтому страница подписок читает готовые записи FeedItem одним
+проходом по индексу (user, -pub_date) вместо соединения Follow и Post.
+Для авторов с огромным числом подписчиков запись ограничена
+FEED_FANOUT_LIMIT: подписчики сверх лимита получают их посты
+слиянием при чтении.
+"""
+from django.conf import settings
+from django.db.models import F, Q
+
+from .models import FeedItem, Follow, Post
+
+FEED_FANOUT_LIMIT = getattr(settings, 'FEED_FANOUT_LIMIT', 1000)
+FEED_BACKFILL_SIZE = getattr(settings, 'FEED_BACKFILL_SIZE', 1000)
+
+
+def _items(user_ids, author_id, posts):
+    return [FeedItem(user_id=user_id,
+                     post_id=post_id,
+                     author_id=author_id,
+                     pub_date=pub_date)
+            for user_id in user_ids
+            for post_id, pub_date in posts]
+
+
+def fan_out_post(post):
+    """Кладёт новый пост в ленты подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id, fanout=True
+    ).values_list('user_id', flat=True)
+    FeedItem.objects.bulk_create(
+        _items(followers, post.author_id, [(post.id, post.pub_date)]),
+        ignore_conflicts=True,
+    )
+
+
+def sync_post_date(post):
+    """Переносит изменённую дату публикации в записи лент."""
+    FeedItem.objects.filter(post_id=post.id).exclude(
+        pub_date=post.pub_date
+    ).update(pub_date=post.pub_date)
+
+
+def use_fanout(author):
+    """Раскладывать ли посты автора новому подписчику при записи."""
+    return Follow.objects.filter(
+        author=author, fanout=True
+    ).count() < FEED_FANOUT_LIMIT
+
+
+def backfill(follow):
+    """Заполняет ленту свежими постами автора при подписке."""
+    if not follow.fanout:
+        return
+    posts = (Post.objects.filter(author_id=follow.author_id)
+             .order_by('-pub_date')
+             .values_list('id', 'pub_date')[:FEED_BACKFILL_SIZE])
+    FeedItem.objects.bulk_create(
+        _items([follow.user_id], follow.author_id, posts),
+        ignore_conflicts=True,
+    )
+
+
+def trim(follow):
+    """Убирает из ленты посты автора после отписки."""
+    FeedItem.objects.filter(
+        user_id=follow.user_id, author_id=follow.author_id
+    ).delete()
+
+
+def feed_for(user):
+    """Посты ленты подписок пользователя, новые сверху."""
+    merged = list(Follow.objects.filter(
+        user=user, fanout=False
+    ).values_list('author_id', flat=True))
+    if not merged:
+        return Post.objects.filter(feed_items__user=user).annotate(
+            feed_date=F('feed_items__pub_date')
+        ).order_by('-feed_date', '-id')
+    return Post.objects.filter(
+        Q(id__in=FeedItem.objects.filter(user=user).values('post_id'))
+        | Q(author_id__in=merged)
+    ).order_by('-pub_date', '-id')
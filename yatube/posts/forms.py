@@ -1,5 +1,8 @@
 from django import forms
-from .models import Post, Comment
+from django.core.files.uploadedfile import UploadedFile
+
+from .dhash import hash_file, informative, same_picture
+from .models import ImageHash, Post, Comment
 
 
 class PostForm(forms.ModelForm):
@@ -12,14 +15,34 @@ class PostForm(forms.ModelForm):
                   'image': 'Можете добавить изображение'
                   }
 
-    def clean_text(self):
-        """Валидация! Обрабатывает случай, если текст не уникален."""
-        cleaned_data = super().clean()
-        post_text = cleaned_data['text']
-        if Post.objects.filter(text=post_text).exists():
-            self.add_error("text",
-                           "Текст не уникален или вы не редактирвали его!")
-        return post_text
+    def clean_image(self):
+        """Почти такая же картинка (пересжатая, другого размера) отмечается
+        как репост: пост хранит свой файл, а в repost_of - имя уже
+        загруженной копии."""
+        image = self.cleaned_data.get('image')
+        if 'image' in self.changed_data:
+            # construct_instance не трогает нередактируемое поле
+            self.instance.repost_of = find_repost(image)
+        return image
+
+
+def find_repost(image):
+    """Имя уже загруженной копии картинки или ''. Близкий хэш - только
+    кандидат, копию подтверждает сравнение самих картинок."""
+    if not isinstance(image, UploadedFile):
+        return ''
+    fingerprint = hash_file(image)
+    if fingerprint is None or not informative(fingerprint[0]):
+        return ''
+    storage = Post._meta.get_field('image').storage
+    for existing in ImageHash.similar(fingerprint[0]):
+        try:
+            with storage.open(existing.name) as file:
+                if same_picture(image, file):
+                    return existing.name
+        except FileNotFoundError:
+            continue
+    return ''
 
 
 class CommentForm(forms.ModelForm):
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.urls import Resolver404
+from django.urls.resolvers import RoutePattern, URLResolver
+
+from posts.url_dispatch import SegmentTrieResolver
+
+# адреса по маршрутам posts/urls.py, от первых в списке до последних
+PATHS = (
+    'new/', 'search/', 'thumbs/card/signature/posts/ab/cd/photo.jpg',
+    'follow/', 'leo/follow/', 'leo/', 'leo/15/edit/', 'group/cats/', '',
+    'leo/15/', 'leo/15/comment', 'leo/15/comment_del/42', 'no/such/page/',
+)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время разбора адресов posts/urls.py штатным '
+            'URLResolver и деревом сегментов из posts/url_dispatch.py.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20000,
+                            help='сколько раз разбирать каждый адрес')
+        parser.add_argument('--rounds', type=int, default=5,
+                            help='берётся лучший из стольких замеров')
+
+    def handle(self, *args, repeat, rounds, **options):
+        plain = URLResolver(RoutePattern(''), 'posts.urls')
+        trie = SegmentTrieResolver(RoutePattern(''), 'posts.urls')
+        total = {'URLResolver': 0, 'дерево': 0}
+        for path in PATHS:
+            timings = {}
+            for name, resolver in (('URLResolver', plain),
+                                   ('дерево', trie)):
+                timings[name] = min(self.measure(resolver, path, repeat)
+                                    for _ in range(rounds))
+                total[name] += timings[name]
+            self.stdout.write(
+                f'{path or "/":45} {self.describe(plain, path):16} '
+                f'URLResolver {timings["URLResolver"]:.2f} мкс, '
+                f'дерево {timings["дерево"]:.2f} мкс'
+            )
+        self.stdout.write(
+            f'Всего: URLResolver {total["URLResolver"]:.2f} мкс, '
+            f'дерево {total["дерево"]:.2f} мкс, в '
+            f'{total["URLResolver"] / total["дерево"]:.1f} раза быстрее'
+        )
+
+    def describe(self, resolver, path):
+        try:
+            return resolver.resolve(path).url_name
+        except Resolver404:
+            return '404'
+
+    def measure(self, resolver, path, repeat):
+        """Среднее время разбора адреса, мкс."""
+        resolver.resolve('')
+        started = time.perf_counter()
+        for _ in range(repeat):
+            try:
+                resolver.resolve(path)
+            except Resolver404:
+                pass
+        return (time.perf_counter() - started) / repeat * 10 ** 6
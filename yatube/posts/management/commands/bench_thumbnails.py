@@ -0,0 +1,124 @@
+import os
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine
+from sorl.thumbnail.parsers import parse_geometry
+
+from posts.thumbnail_engine import Engine as FastEngine
+from posts.thumbnails import THUMBNAIL_VARIANTS
+
+# размеры синтетических фотографий, если свои картинки не переданы
+CORPUS_SIZES = ((6000, 4000), (4032, 3024), (1920, 1080), (800, 600))
+
+
+def make_corpus(directory):
+    """Создаёт JPEG с градиентом и деталями, похожие на снимки с камеры."""
+    paths = []
+    for width, height in CORPUS_SIZES:
+        image = Image.linear_gradient('L').resize((width, height))
+        image = Image.merge('RGB', (image, image.rotate(90), image))
+        draw = ImageDraw.Draw(image)
+        for x in range(0, width, 37):
+            draw.line((x, 0, width - x, height), fill=(x % 256, 80, 160))
+        path = os.path.join(directory, f'{width}x{height}.jpg')
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость штатного движка PIL из sorl и '
+            'posts.thumbnail_engine.Engine на наборе картинок и размер '
+            'превью в JPEG и в вариантах AVIF/WebP.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='картинки; по умолчанию синтетический набор')
+        parser.add_argument('--geometry', default='960x339')
+        parser.add_argument('--crop', default='center')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, paths, geometry, crop, repeat, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = paths or make_corpus(directory)
+            sources = {os.path.basename(path): open(path, 'rb').read()
+                       for path in paths}
+            thumb_options = dict(ThumbnailBackend.default_options,
+                                 crop=crop, upscale=True)
+            results = {}
+            for name, engine in (('sorl PIL', PILEngine()),
+                                 ('fast', FastEngine())):
+                results[name] = self.measure(engine, sources, geometry,
+                                             thumb_options, repeat)
+        for image in sources:
+            line = ', '.join(f'{name} {self.format(times.get(image))}'
+                             for name, times in results.items())
+            self.stdout.write(f'{image}: {line}')
+        totals = {name: sum(times.values()) for name, times in results.items()
+                  if len(times) == len(sources)}
+        if len(totals) == 2:
+            stock, fast = totals['sorl PIL'], totals['fast']
+            self.stdout.write(f'Итого: sorl PIL {stock * 1000:.0f} мс, '
+                              f'fast {fast * 1000:.0f} мс, '
+                              f'ускорение x{stock / fast:.1f}')
+        self.report_sizes(sources, geometry, thumb_options)
+
+    def report_sizes(self, sources, geometry, options):
+        """Средний размер превью в каждом формате."""
+        engine = FastEngine()
+        sizes = {'JPEG': []}
+        sizes.update((image_format, []) for image_format in THUMBNAIL_VARIANTS)
+        for data in sources.values():
+            image = engine.get_image(BytesIO(data))
+            ratio = engine.get_image_ratio(image, options)
+            thumbnail = engine.create(image, parse_geometry(geometry, ratio),
+                                      dict(options))
+            sizes['JPEG'].append(len(engine._get_raw_data(
+                thumbnail, 'JPEG', options['quality'], {}
+            )))
+            for image_format in THUMBNAIL_VARIANTS:
+                sizes[image_format].append(
+                    len(engine.encode(thumbnail, image_format))
+                )
+        jpeg = sum(sizes['JPEG'])
+        for image_format, values in sizes.items():
+            average = sum(values) / len(values) / 1024
+            self.stdout.write(f'{image_format}: в среднем {average:.1f} КБ, '
+                              f'{sum(values) / jpeg:.0%} от JPEG')
+
+    def measure(self, engine, sources, geometry, options, repeat):
+        """Лучшее время построения превью каждой картинки, в секундах."""
+        times = {}
+        for image_name, data in sources.items():
+            best = None
+            try:
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    self.build(engine, data, geometry, dict(options))
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+            except Exception as error:
+                self.stderr.write(f'{type(engine).__module__}: {image_name}: '
+                                  f'{error!r}')
+                continue
+            times[image_name] = best
+        return times
+
+    @staticmethod
+    def build(engine, data, geometry, options):
+        image = engine.get_image(BytesIO(data))
+        ratio = engine.get_image_ratio(image, options)
+        thumbnail = engine.create(image, parse_geometry(geometry, ratio),
+                                  options)
+        return engine._get_raw_data(thumbnail, options['format'],
+                                    options['quality'],
+                                    engine.get_image_info(image))
+
+    @staticmethod
+    def format(seconds):
+        return 'ошибка' if seconds is None else f'{seconds * 1000:.1f} мс'
@@ -0,0 +1,130 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.urls import reverse
+
+from posts.models import Comment, Group, Post
+
+User = get_user_model()
+# комментариев на пост на синтетической странице
+COMMENTS_PER_POST = 3
+
+
+def make_page(cards):
+    """Посты страницы с авторами, группами и комментариями, без БД."""
+    group = Group(title='Группа', slug='bench-group')
+    posts = []
+    for number in range(cards):
+        author = User(username=f'author_{number % 7}')
+        post = Post(id=number + 1, text='текст', author=author,
+                    group=group if number % 2 else None)
+        post.bench_comments = [
+            Comment(id=number * COMMENTS_PER_POST + index + 1, post=post,
+                    author=author, text='комментарий')
+            for index in range(COMMENTS_PER_POST)
+        ]
+        posts.append(post)
+    return posts
+
+
+# ссылки карточки и комментариев в шаблоне до и после url_builders
+REVERSE_TEMPLATE = """{% for post in posts %}
+{% url 'profile' post.author.username %}
+{% url 'post' post.author.username post.id %}
+{% url 'post_edit' post.author.username post.id %}
+{% url 'post_del' post.author.username post.id %}
+{% if post.group %}{% url 'group_posts' post.group.slug %}{% endif %}
+{% for item in post.bench_comments %}
+{% url 'profile' item.author.username %}
+{% url 'comment_del' post.author.username post.id item.id %}
+{% endfor %}{% endfor %}"""
+BUILDERS_TEMPLATE = """{% for post in posts %}
+{{ post.author_url }}
+{{ post.get_absolute_url }}
+{{ post.edit_url }}
+{{ post.delete_url }}
+{% if post.group %}{{ post.group_url }}{% endif %}
+{% for item in post.bench_comments %}
+{{ item.author_url }}
+{{ item.delete_url }}
+{% endfor %}{% endfor %}"""
+
+
+def with_reverse(posts):
+    """Ссылки карточек и комментариев, как их строил {% url %}."""
+    links = []
+    for post in posts:
+        username = post.author.username
+        links.append(reverse('profile', args=[username]))
+        links.append(reverse('post', args=[username, post.id]))
+        links.append(reverse('post_edit', args=[username, post.id]))
+        links.append(reverse('post_del', args=[username, post.id]))
+        if post.group:
+            links.append(reverse('group_posts', args=[post.group.slug]))
+        for comment in post.bench_comments:
+            links.append(reverse('profile', args=[comment.author.username]))
+            links.append(reverse('comment_del',
+                                 args=[username, post.id, comment.id]))
+    return links
+
+
+def with_builders(posts):
+    """Те же ссылки через атрибуты моделей, см. posts/url_builders.py."""
+    links = []
+    for post in posts:
+        links.append(post.author_url)
+        links.append(post.get_absolute_url())
+        links.append(post.edit_url)
+        links.append(post.delete_url)
+        if post.group:
+            links.append(post.group_url)
+        for comment in post.bench_comments:
+            links.append(comment.author_url)
+            links.append(comment.delete_url)
+    return links
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время построения ссылок страницы карточек через '
+            'reverse() и через posts/url_builders.py: в коде и в шаблоне '
+            '({% url %} против атрибутов поста и комментария).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, nargs='+',
+                            default=[10, 100],
+                            help='карточек на странице')
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='сколько раз строить страницу')
+
+    def handle(self, *args, cards, repeat, **options):
+        for count in cards:
+            posts = make_page(count)
+            if with_reverse(posts) != with_builders(posts):
+                self.stderr.write(f'{count} карточек: ссылки различаются')
+                continue
+            links = len(with_reverse(posts))
+            old, new = (engines['django'].from_string(source)
+                        for source in (REVERSE_TEMPLATE, BUILDERS_TEMPLATE))
+            context = {'posts': posts}
+            for label, before, after in (
+                ('код', lambda: with_reverse(posts),
+                 lambda: with_builders(posts)),
+                ('шаблон', lambda: old.render(context),
+                 lambda: new.render(context)),
+            ):
+                was, now = (self.measure(build, repeat)
+                            for build in (before, after))
+                self.stdout.write(
+                    f'{count} карточек, {links} ссылок, {label}: '
+                    f'reverse() {was:.3f} мс, url_builders {now:.3f} мс, '
+                    f'в {was / now:.1f} раза быстрее'
+                )
+
+    def measure(self, build, repeat):
+        """Среднее время одного построения страницы, мс."""
+        started = time.perf_counter()
+        for _ in range(repeat):
+            build()
+        return (time.perf_counter() - started) / repeat * 1000
@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from posts import og_images, og_worker
+from posts.models import Post
+
+
+def build(post_id):
+    """Строит картинку поста в процессе-воркере; ошибку возвращает
+    текстом."""
+    try:
+        og_images.build(post_id)
+    except Exception as error:
+        return f'{post_id}: {error!r}'
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Строит картинки og:image постов, у которых их ещё нет или '
+            'которые устарели после правки, в пуле процессов. Прерванный '
+            'запуск можно продолжить с --after-pk.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--after-pk', type=int, default=0,
+                            help='продолжить с постов после этого pk')
+
+    def handle(self, *args, batch_size, workers, after_pk, **options):
+        if batch_size < 1 or workers < 1:
+            raise CommandError('--batch-size и --workers должны быть > 0')
+        started = time.monotonic()
+        built = failed = 0
+        posts = Post.objects.select_related('author').order_by('pk')
+        # воркеры не должны наследовать открытые соединения с БД
+        connections.close_all()
+        with ProcessPoolExecutor(workers,
+                                 initializer=og_worker.init) as pool:
+            while True:
+                batch = list(posts.filter(pk__gt=after_pk)[:batch_size])
+                if not batch:
+                    break
+                after_pk = batch[-1].pk
+                missing = [post.pk for post in batch
+                           if post.og_image != og_images.image_name(post)]
+                connections.close_all()
+                chunksize = max(1, len(missing) // (workers * 4))
+                errors = [error for error in pool.map(
+                    build, missing, chunksize=chunksize
+                ) if error]
+                for error in errors:
+                    self.stderr.write(error)
+                failed += len(errors)
+                built += len(missing) - len(errors)
+                self.stdout.write(
+                    f'pk до {after_pk}: построено {built}, ошибок {failed}, '
+                    f'{time.monotonic() - started:.1f} с'
+                )
+        self.stdout.write(f'Построено картинок: {built}, ошибок: {failed}')
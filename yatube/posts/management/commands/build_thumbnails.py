@@ -0,0 +1,100 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def init_worker():
+    # при запуске через spawn воркер стартует без настроенного Django
+    django.setup()
+
+
+def build(name, spec):
+    """Строит одно превью в процессе-воркере; ошибку возвращает текстом."""
+    try:
+        thumbnails.get_or_create(name, spec)
+    except Exception as error:
+        # битая картинка не должна останавливать весь проход
+        return f'{name} [{spec}]: {error!r}'
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Строит превью картинок постов по THUMBNAIL_SPECS в пуле '
+            'процессов и записывает их в хранилище ключей sorl. Уже '
+            'построенные превью пропускаются, поэтому прерванный запуск '
+            'можно повторить или продолжить с --after-pk.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--spec', action='append', dest='specs',
+                            choices=sorted(thumbnails.THUMBNAIL_SPECS),
+                            help='по умолчанию все спецификации')
+        parser.add_argument('--after-pk', type=int, default=0,
+                            help='продолжить с постов после этого pk')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только посчитать недостающие превью')
+
+    def handle(self, *args, batch_size, workers, specs, after_pk, dry_run,
+               **options):
+        if batch_size < 1 or workers < 1:
+            raise CommandError('--batch-size и --workers должны быть > 0')
+        specs = specs or sorted(thumbnails.THUMBNAIL_SPECS)
+        started = time.monotonic()
+        built = skipped = failed = 0
+        pool = None
+        if not dry_run:
+            # воркеры не должны наследовать открытые соединения с БД
+            connections.close_all()
+            pool = ProcessPoolExecutor(workers, initializer=init_worker)
+        try:
+            for last_pk, missing, done in self.batches(after_pk, batch_size,
+                                                       specs):
+                skipped += done
+                errors = []
+                if missing and not dry_run:
+                    names, batch_specs = zip(*missing)
+                    chunksize = max(1, len(missing) // (workers * 4))
+                    errors = [error for error in pool.map(
+                        build, names, batch_specs, chunksize=chunksize
+                    ) if error]
+                for error in errors:
+                    self.stderr.write(error)
+                failed += len(errors)
+                built += len(missing) - len(errors)
+                self.report(last_pk, built, skipped, failed, started)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        verb = 'Нужно построить' if dry_run else 'Построено'
+        self.stdout.write(f'{verb} превью: {built}, уже были: {skipped}, '
+                          f'ошибок: {failed}')
+
+    def batches(self, last_pk, batch_size, specs):
+        """Пакеты (последний pk, недостающие превью, число готовых)."""
+        posts = (Post.objects.filter(image__isnull=False).exclude(image='')
+                 .order_by('pk'))
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk)
+                         .values_list('pk', 'image')[:batch_size])
+            if not batch:
+                return
+            last_pk = batch[-1][0]
+            wanted = [(name, spec) for _, name in batch for spec in specs]
+            missing = [(name, spec) for name, spec in wanted
+                       if not thumbnails.built(name, spec)]
+            yield last_pk, missing, len(wanted) - len(missing)
+
+    def report(self, last_pk, built, skipped, failed, started):
+        elapsed = time.monotonic() - started
+        rate = built / elapsed if elapsed else 0
+        self.stdout.write(f'pk до {last_pk}: новых превью {built}, '
+                          f'пропущено {skipped}, ошибок {failed}, '
+                          f'{rate:.1f} превью/с')
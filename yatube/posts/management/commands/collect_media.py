@@ -0,0 +1,153 @@
+import hashlib
+import os
+import shutil
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from posts import og_images, thumbnails
+from posts.models import ImageHash, Post
+
+
+def name_digest(name):
+    return int.from_bytes(
+        hashlib.blake2b(name.encode(), digest_size=8).digest(),
+        'big', signed=True,
+    )
+
+
+class NameSet:
+    """Множество имён файлов по 8 байт на имя: отсортированный массив
+    64-битных хэшей вместо set строк, чтобы миллионы имён помещались в
+    память. Совпадение хэшей только оставит лишний файл на диске."""
+
+    def __init__(self, names):
+        self.digests = array('q', sorted(map(name_digest, names)))
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __contains__(self, name):
+        digest = name_digest(name)
+        index = bisect_left(self.digests, digest)
+        return (index < len(self.digests)
+                and self.digests[index] == digest)
+
+
+def walk(directory):
+    """Файлы каталога и его подкаталогов через os.scandir, без списков
+    всего дерева в памяти."""
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки постов, на которые не ссылается ни один пост, '
+            'вместе с их превью, записями sorl и перцептивными хэшами, '
+            'затем превью, о которых не знает хранилище ключей sorl, и '
+            'старые картинки og:image. '
+            'Свежие файлы не трогаются: их пост может быть ещё не '
+            'сохранён.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='не трогать файлы моложе стольких часов')
+        parser.add_argument('--quarantine',
+                            help='переносить файлы в этот каталог '
+                                 'вместо удаления')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только показать, что будет удалено')
+
+    def handle(self, *args, batch_size, min_age, quarantine, dry_run,
+               **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть > 0')
+        self.root = settings.MEDIA_ROOT
+        self.quarantine = quarantine
+        self.dry_run = dry_run
+        self.deadline = time.time() - min_age * 60 * 60
+        self.removed = self.freed = 0
+        upload_to = Post._meta.get_field('image').upload_to
+        names = (Post.objects.exclude(image='').exclude(image__isnull=True)
+                 .values_list('image', flat=True))
+        self.collect(upload_to, NameSet(names.iterator()), batch_size,
+                     self.remove_originals)
+        self.collect(sorl_settings.THUMBNAIL_PREFIX,
+                     NameSet(name for stored in thumbnails.stored_names()
+                             for name in thumbnails.with_variants(stored)),
+                     batch_size, self.remove_files)
+        self.collect(og_images.DIRECTORY,
+                     NameSet(Post.objects.exclude(og_image='')
+                             .values_list('og_image', flat=True).iterator()),
+                     batch_size, self.remove_files)
+        verb = 'Будет удалено' if dry_run else 'Удалено'
+        self.stdout.write(f'{verb} файлов: {self.removed}, '
+                          f'{self.freed / 1024 / 1024:.1f} МБ')
+
+    def collect(self, directory, referenced, batch_size, remove):
+        """Проходит каталог и пакетами убирает файлы не из referenced."""
+        started = time.monotonic()
+        scanned = 0
+        batch = []
+        for entry in walk(os.path.join(self.root, directory)):
+            scanned += 1
+            name = os.path.relpath(entry.path, self.root).replace(os.sep,
+                                                                  '/')
+            if name in referenced or entry.stat().st_mtime > self.deadline:
+                continue
+            batch.append(name)
+            if len(batch) >= batch_size:
+                remove(batch)
+                batch = []
+                self.report(directory, scanned, started)
+        if batch:
+            remove(batch)
+        self.report(directory, scanned, started)
+
+    def remove_originals(self, names):
+        files = list(names)
+        if not self.dry_run:
+            files.extend(thumbnails.forget(names))
+            # иначе ImageHash.similar предлагал бы удалённые файлы
+            ImageHash.objects.filter(name__in=names).delete()
+        self.remove_files(files)
+
+    def remove_files(self, names):
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                size = os.path.getsize(path)
+                if self.dry_run:
+                    self.stdout.write(name)
+                elif self.quarantine:
+                    target = os.path.join(self.quarantine, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(path, target)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                # варианты превью есть не у всех превью
+                continue
+            self.removed += 1
+            self.freed += size
+
+    def report(self, directory, scanned, started):
+        elapsed = time.monotonic() - started
+        rate = scanned / elapsed if elapsed else 0
+        self.stdout.write(f'{directory}: просмотрено {scanned}, '
+                          f'убрано {self.removed}, {rate:.0f} файлов/с')
@@ -0,0 +1,141 @@
+import heapq
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from posts import page_cache, thumbnails
+
+THUMBNAIL_CACHE_MAX_SIZE = getattr(settings, 'THUMBNAIL_CACHE_MAX_SIZE',
+                                   5 * 1024 ** 3)
+# вытеснение идёт с запасом, чтобы следующий запуск не начинал его сразу
+LOW_WATER = 0.9
+SIZE = re.compile(r'^(\d+)([KMG]?)$', re.IGNORECASE)
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value):
+    match = SIZE.match(value.strip())
+    if not match:
+        raise CommandError(f'Неверный размер: {value}, нужно 500M, 2G...')
+    return int(match.group(1)) * UNITS[match.group(2).upper()]
+
+
+def groups(directory):
+    """Превью вместе с вариантами: (последний доступ, размер, пути).
+
+    Варианты лежат в том же каталоге, что и превью, с тем же именем,
+    поэтому группы собираются по одному каталогу за раз.
+    """
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        found = {}
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                file_stat = entry.stat(follow_symlinks=False)
+                stem = os.path.splitext(entry.path)[0]
+                accessed, size, paths = found.get(stem, (0, 0, []))
+                paths.append(entry.path)
+                found[stem] = (max(accessed, file_stat.st_atime),
+                               size + file_stat.st_size, paths)
+        yield from found.values()
+
+
+class Command(BaseCommand):
+    help = ('Держит каталог превью sorl в пределах --max-size: удаляет '
+            'давно не открывавшиеся превью (по atime, см. yatube/media.py) '
+            'вместе с вариантами и записями sorl. Удалённое превью '
+            'строится заново при следующем запросе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-size', type=parse_size,
+                            default=THUMBNAIL_CACHE_MAX_SIZE,
+                            help='бюджет на диске, например 500M или 2G')
+        parser.add_argument('--min-idle', type=float, default=48,
+                            help='не трогать превью, открытые за столько '
+                                 'часов; больше срока жизни кэша карточек')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--every', type=float,
+                            help='повторять раз в столько секунд')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только посчитать, что будет удалено')
+
+    def handle(self, *args, max_size, min_idle, batch_size, every, dry_run,
+               **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть > 0')
+        self.directory = os.path.join(settings.MEDIA_ROOT,
+                                      sorl_settings.THUMBNAIL_PREFIX)
+        while True:
+            self.prune(max_size, min_idle * 60 * 60, batch_size, dry_run)
+            if not every:
+                return
+            time.sleep(every)
+
+    def prune(self, max_size, min_idle, batch_size, dry_run):
+        started = time.monotonic()
+        total = sum(size for _, size, _ in groups(self.directory))
+        if total <= max_size:
+            self.stdout.write(f'Превью занимают {total / 1024 ** 2:.1f} МБ '
+                              f'из {max_size / 1024 ** 2:.1f} МБ')
+            return
+        victims = self.least_recent(total - max_size * LOW_WATER,
+                                    time.time() - min_idle)
+        freed = 0
+        for start in range(0, len(victims), batch_size):
+            batch = victims[start:start + batch_size]
+            freed += sum(size for _, size, _ in batch)
+            if not dry_run:
+                self.evict([path for _, _, paths in batch for path in paths])
+        if victims and not dry_run:
+            # в закэшированных страницах могли остаться ссылки на файлы
+            page_cache.invalidate()
+        verb = 'Будет удалено' if dry_run else 'Удалено'
+        self.stdout.write(
+            f'{verb} превью: {len(victims)}, {freed / 1024 ** 2:.1f} МБ; '
+            f'было {total / 1024 ** 2:.1f} МБ, '
+            f'{time.monotonic() - started:.1f} с'
+        )
+
+    def least_recent(self, excess, deadline):
+        """Самые давние по доступу группы общим размером от excess.
+
+        В куче хранятся только кандидаты на удаление, а не все превью.
+        """
+        heap = []
+        selected = 0
+        for accessed, size, paths in groups(self.directory):
+            if accessed > deadline:
+                continue
+            heapq.heappush(heap, (-accessed, size, paths))
+            selected += size
+            # самая свежая из выбранных групп не нужна, если и без неё
+            # освобождается достаточно
+            while heap and selected - heap[0][1] >= excess:
+                selected -= heapq.heappop(heap)[1]
+        return sorted(((-accessed, size, paths)
+                       for accessed, size, paths in heap),
+                      key=lambda group: group[0])
+
+    def evict(self, paths):
+        names = [os.path.relpath(path, settings.MEDIA_ROOT)
+                 .replace(os.sep, '/') for path in paths]
+        # сначала записи: иначе sorl успел бы отдать ссылку на пустое место
+        thumbnails.forget_thumbnails(names)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, Follow, Post, UserStats
+
+User = get_user_model()
+
+
+def counted(queryset, field):
+    """Подзапрос: число строк queryset, у которых field - pk внешней
+    строки. Счёт и запись идут одним UPDATE, и запись, попавшая между
+    ними, не теряется."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики постов, подписок и комментариев '
+            'пакетами по первичному ключу.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        users = self.recount(User, batch_size, self.recount_users)
+        posts = self.recount(Post, batch_size, self.recount_posts)
+        self.stdout.write(
+            f'Пересчитано: пользователей {users}, постов {posts}'
+        )
+
+    def recount(self, model, batch_size, recount_batch):
+        """Проходит таблицу пакетами по возрастанию pk."""
+        done, last_pk = 0, 0
+        while True:
+            ids = list(model.objects.filter(pk__gt=last_pk)
+                       .order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return done
+            with transaction.atomic():
+                recount_batch(ids)
+            done += len(ids)
+            last_pk = ids[-1]
+
+    def recount_users(self, ids):
+        # недостающие строки, уже созданные параллельно, не трогаются
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=user_id) for user_id in ids],
+            ignore_conflicts=True,
+        )
+        UserStats.objects.filter(user_id__in=ids).update(
+            posts_count=counted(Post.objects, 'author_id'),
+            followers_count=counted(Follow.objects, 'author_id'),
+            following_count=counted(Follow.objects, 'user_id'),
+        )
+
+    def recount_posts(self, ids):
+        comments = counted(Comment.objects, 'post_id')
+        # version - чтобы закэшированные карточки показали новый счётчик
+        (Post.objects.filter(pk__in=ids).exclude(comment_count=comments)
+         .update(comment_count=comments, version=F('version') + 1))
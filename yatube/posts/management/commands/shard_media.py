@@ -0,0 +1,127 @@
+import hashlib
+import os
+import re
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import page_cache
+from posts.counters import bump_version
+from posts.models import ImageHash, Post
+from posts.storage import HASH_LENGTH, sharded
+
+HASHED_NAME = re.compile(rf'^[0-9a-f]{{{HASH_LENGTH}}}\.\w+$')
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_name(path):
+    """Имя по хэшу содержимого для старой загрузки с произвольным именем."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    extension = os.path.splitext(path)[1].lower()
+    return digest.hexdigest()[:HASH_LENGTH] + extension
+
+
+def rename_hash(name, target):
+    """Перцептивный хэш файла переходит к новому имени."""
+    hashes = ImageHash.objects.filter(name=name)
+    if ImageHash.objects.filter(name=target).exists():
+        # тот же файл уже хэширован под новым именем
+        hashes.delete()
+    else:
+        hashes.update(name=target)
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов из плоского каталога в '
+            'каталоги по префиксу хэша (posts/ab/cd/abcd...) и пакетами '
+            'переписывает Post.image. Повторный запуск продолжает с '
+            'места остановки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только показать, что будет перенесено')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть > 0')
+        self.storage = Post._meta.get_field('image').storage
+        moved = missing = 0
+        last_name = ''
+        while True:
+            names = list(Post.objects.filter(image__gt=last_name)
+                         .exclude(image__regex=r'/[0-9a-f]{2}/[0-9a-f]{2}/')
+                         .order_by('image')
+                         .values_list('image', flat=True)
+                         .distinct()[:batch_size])
+            if not names:
+                break
+            last_name = names[-1]
+            renames = {}
+            for name in names:
+                target = self.target(name)
+                if target is None:
+                    missing += 1
+                    self.stderr.write(f'Нет файла: {name}')
+                else:
+                    renames[name] = target
+            if not dry_run:
+                self.migrate(renames)
+            else:
+                for name, target in renames.items():
+                    self.stdout.write(f'{name} -> {target}')
+            moved += len(renames)
+            self.stdout.write(f'До {last_name}: перенесено {moved}, '
+                              f'без файла {missing}')
+        if moved and not dry_run:
+            page_cache.invalidate()
+        self.stdout.write(f'Перенесено картинок: {moved}, '
+                          f'без файла: {missing}')
+
+    def target(self, name):
+        """Новое имя файла или None, если файла нет ни там, ни там."""
+        directory, filename = os.path.split(name)
+        path = self.storage.path(name)
+        if HASHED_NAME.match(filename):
+            target = sharded(directory, filename)
+            if os.path.exists(path) or self.storage.exists(target):
+                return target
+            return None
+        if not os.path.exists(path):
+            return None
+        return sharded(directory, content_name(path))
+
+    def migrate(self, renames):
+        """Новое имя появляется до записи в БД, старое исчезает после.
+
+        Прерванный запуск оставляет лишь лишние ссылки на тот же файл.
+        """
+        for name, target in renames.items():
+            self.link(self.storage.path(name), self.storage.path(target))
+        with transaction.atomic():
+            for name, target in renames.items():
+                posts = Post.objects.filter(image=name)
+                # в закэшированных карточках остался старый адрес картинки
+                bump_version(posts)
+                posts.update(image=target)
+                Post.objects.filter(repost_of=name).update(repost_of=target)
+                rename_hash(name, target)
+        for name in renames:
+            path = self.storage.path(name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def link(source, target):
+        if os.path.exists(target):
+            # тот же хэш - то же содержимое
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
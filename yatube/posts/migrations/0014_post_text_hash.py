@@ -0,0 +1,50 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:41
+
+from django.db import migrations
+import posts.models
+
+BATCH_SIZE = 1000
+
+
+def fill_text_hash(apps, schema_editor):
+    """Считает хэши пакетами; у повторов текста хэш остаётся пустым,
+    чтобы уже существующие дубли не мешали уникальному индексу."""
+    Post = apps.get_model('posts', 'Post')
+    last_pk = 0
+    while True:
+        batch = list(Post.objects.filter(pk__gt=last_pk)
+                     .order_by('pk').only('pk', 'text')[:BATCH_SIZE])
+        if not batch:
+            return
+        hashes = {post.pk: posts.models.text_hash(post.text)
+                  for post in batch}
+        seen = set(Post.objects.filter(
+            text_hash__in=hashes.values()
+        ).values_list('text_hash', flat=True))
+        for post in batch:
+            digest = hashes[post.pk]
+            post.text_hash = None if digest in seen else digest
+            seen.add(digest)
+        Post.objects.bulk_update(batch, ['text_hash'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='text_hash',
+            field=posts.models.TextHashField(db_index=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_text_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='text_hash',
+            field=posts.models.TextHashField(editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations
+
+import posts.search
+
+CREATE_SQL = [
+    """CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+        stems, tokenize = 'unicode61 remove_diacritics 0'
+    )""",
+    """CREATE TRIGGER posts_post_fts_insert AFTER INSERT ON posts_post
+    BEGIN
+        INSERT INTO posts_post_fts (rowid, stems)
+        VALUES (new.id, ru_stems(new.text));
+    END""",
+    """CREATE TRIGGER posts_post_fts_update AFTER UPDATE OF text ON posts_post
+    BEGIN
+        UPDATE posts_post_fts SET stems = ru_stems(new.text)
+        WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER posts_post_fts_delete AFTER DELETE ON posts_post
+    BEGIN
+        DELETE FROM posts_post_fts WHERE rowid = old.id;
+    END""",
+    """INSERT INTO posts_post_fts (rowid, stems)
+    SELECT id, ru_stems(text) FROM posts_post""",
+]
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS posts_post_fts_insert',
+    'DROP TRIGGER IF EXISTS posts_post_fts_update',
+    'DROP TRIGGER IF EXISTS posts_post_fts_delete',
+    'DROP TABLE IF EXISTS posts_post_fts',
+]
+
+
+def create_index(apps, schema_editor):
+    """Создаёт индекс FTS5 и заполняет его уже существующими постами."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.connection.ensure_connection()
+    posts.search.register_stemmer(schema_editor.connection.connection)
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_text_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
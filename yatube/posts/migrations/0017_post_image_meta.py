@@ -0,0 +1,61 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:58
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import migrations, models
+import posts.placeholders
+
+BATCH_SIZE = 500
+
+
+def fill_image_meta(apps, schema_editor):
+    """Открывает каждую уже загруженную картинку один раз, пакетами."""
+    Post = apps.get_model('posts', 'Post')
+    storage = Post._meta.get_field('image').storage
+    posts_with_image = (Post.objects.exclude(image='')
+                        .exclude(image__isnull=True).order_by('pk'))
+    last_pk = 0
+    while True:
+        batch = list(posts_with_image.filter(pk__gt=last_pk)
+                     .only('pk', 'image')[:BATCH_SIZE])
+        if not batch:
+            return
+        found = {}
+        for name in {post.image.name for post in batch}:
+            try:
+                with storage.open(name) as file:
+                    found[name] = posts.placeholders.describe(file)
+            except (OSError, SuspiciousFileOperation):
+                found[name] = None
+        for post in batch:
+            post.image_width, post.image_height, post.image_placeholder = (
+                found[post.image.name] or (None, None, '')
+            )
+        Post.objects.bulk_update(batch, ['image_width', 'image_height',
+                                         'image_placeholder'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_post_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_height',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_image_meta, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:06
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import migrations, models
+import posts.dhash
+
+BATCH_SIZE = 500
+
+
+def fill_image_hashes(apps, schema_editor):
+    """Хэширует уже загруженные картинки, каждый файл один раз."""
+    Post = apps.get_model('posts', 'Post')
+    ImageHash = apps.get_model('posts', 'ImageHash')
+    storage = Post._meta.get_field('image').storage
+    last_name = ''
+    while True:
+        names = list(Post.objects.filter(image__gt=last_name)
+                     .order_by('image').values_list('image', flat=True)
+                     .distinct()[:BATCH_SIZE])
+        if not names:
+            return
+        last_name = names[-1]
+        hashes = []
+        for name in names:
+            try:
+                with storage.open(name) as file:
+                    fingerprint = posts.dhash.hash_file(file)
+            except (OSError, SuspiciousFileOperation):
+                continue
+            if fingerprint:
+                value, width, height = fingerprint
+                band_0, band_1, band_2, band_3 = posts.dhash.bands(value)
+                hashes.append(ImageHash(
+                    name=name, value=value, width=width, height=height,
+                    band_0=band_0, band_1=band_1, band_2=band_2,
+                    band_3=band_3,
+                ))
+        ImageHash.objects.bulk_create(hashes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_image_meta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageHash',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField()),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('band_0', models.PositiveIntegerField(db_index=True)),
+                ('band_1', models.PositiveIntegerField(db_index=True)),
+                ('band_2', models.PositiveIntegerField(db_index=True)),
+                ('band_3', models.PositiveIntegerField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(fill_image_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='og_image',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
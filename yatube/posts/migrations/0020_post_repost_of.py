@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_og_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='repost_of',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
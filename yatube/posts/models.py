@@ -1,7 +1,47 @@
+import hashlib
+import unicodedata
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
 from django.db import models
 
+from . import thumbnails
+from .dhash import bands, hamming, hash_file
+from .placeholders import describe
+from .storage import ContentAddressedStorage
+from .url_builders import url_for
+
 User = get_user_model()
+# расстояние Хэмминга, до которого картинки считаются одной; больше
+# dhash.BANDS - 1 поиск по частям хэша может пропускать совпадения
+IMAGE_DUPLICATE_DISTANCE = getattr(settings, 'IMAGE_DUPLICATE_DISTANCE', 3)
+DUPLICATE_TEXT_ERROR = 'Текст не уникален!'
+
+
+def text_hash(text):
+    """sha256 текста без учёта пробелов по краям и их количества."""
+    normalized = ' '.join(unicodedata.normalize('NFC', text).split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class TextHashField(models.CharField):
+    """Хэш поля text, пересчитывается при каждом сохранении,
+    в том числе в bulk_create. Повторы текста, оставшиеся с времён до
+    уникального индекса (хэш пустой, см. миграцию 0014), остаются без
+    хэша, пока их текст не поменяют."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 64)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        if not add and model_instance.is_legacy_duplicate():
+            return None
+        value = text_hash(model_instance.text)
+        setattr(model_instance, self.attname, value)
+        return value
 
 
 class Group(models.Model):
@@ -32,10 +72,208 @@ class Post(models.Model):
                               null=True,
                               on_delete=models.SET_NULL,
                               related_name="posts")
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # имя файла - хэш содержимого, см. posts/storage.py
+    image = models.ImageField(upload_to='posts/', blank=True, null=True,
+                              storage=ContentAddressedStorage())
+    # считаются один раз при загрузке, см. posts/placeholders.py; не
+    # width_field/height_field ImageField, которые открывают файл при
+    # создании объекта, если размеры ещё не заполнены
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    image_placeholder = models.TextField(blank=True, default='',
+                                         editable=False)
+    # уникальный индекс по хэшу вместо сравнения полного текста
+    text_hash = TextHashField(unique=True, null=True)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # версия карточки поста в кэше, растёт при правке поста и комментариях
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # почти такая же картинка, загруженная раньше (репост), см. PostForm
+    repost_of = models.CharField(max_length=100, blank=True, default='',
+                                 editable=False)
+    # картинка для превью ссылки, строится в фоне, см. posts/og_images.py
+    og_image = models.CharField(max_length=100, blank=True, default='',
+                                editable=False)
 
     class Meta:
-        ordering = ["-pub_date"]
+        ordering = ["-pub_date", "-id"]
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"],
+                         name="post_date_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"],
+                         name="post_group_date_idx"),
+            models.Index(fields=["author", "-pub_date", "-id"],
+                         name="post_author_date_idx"),
+        ]
+
+    # меняются только атомарным UPDATE из сигналов и фоновых задач, иначе
+    # правка поста затёрла бы их устаревшими значениями
+    COUNTER_FIELDS = ('comment_count', 'version', 'og_image')
+    # имя картинки при чтении из БД: по нему save замечает её замену
+    _loaded_image = None
+    # текст при чтении из БД: по нему видно, что повтор текста не правили
+    _loaded_text = None
+
+    # адреса для шаблонов карточки, см. posts/url_builders.py
+    def get_absolute_url(self):
+        return url_for('post', self.author.username, self.id)
+
+    @property
+    def author_url(self):
+        return url_for('profile', self.author.username)
+
+    @property
+    def edit_url(self):
+        return url_for('post_edit', self.author.username, self.id)
+
+    @property
+    def delete_url(self):
+        return url_for('post_del', self.author.username, self.id)
+
+    @property
+    def group_url(self):
+        return url_for('group_posts', self.group.slug) if self.group else ''
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super().from_db(db, field_names, values)
+        # сырое значение, без обращения к отложенному полю
+        post._loaded_image = post.__dict__.get('image')
+        post._loaded_text = post.__dict__.get('text')
+        return post
+
+    def is_legacy_duplicate(self):
+        """Старый повтор текста без хэша, текст которого не меняли."""
+        return (self.pk is not None and self.text_hash is None
+                and self.text == self._loaded_text)
+
+    def validate_unique(self, exclude=None):
+        """Уникальность текста по хэшу: text_hash не редактируется, и
+        штатная проверка ModelForm (в том числе в админке) его пропускает.
+        Сам редактируемый пост не считается."""
+        super().validate_unique(exclude)
+        if exclude and 'text' in exclude or self.is_legacy_duplicate():
+            return
+        duplicates = Post.objects.filter(text_hash=text_hash(self.text))
+        if self.pk is not None:
+            duplicates = duplicates.exclude(pk=self.pk)
+        if duplicates.exists():
+            raise ValidationError({'text': DUPLICATE_TEXT_ERROR})
+
+    def update_image_meta(self):
+        """Размеры, заглушка и перцептивный хэш новой картинки,
+        сохранённой в хранилище."""
+        if not self.image:
+            self.image_width = self.image_height = None
+            self.image_placeholder = ''
+            return
+        if not self.image._committed:
+            # размеры нужны у уменьшенной картинки из хранилища, а не у
+            # исходной загрузки, поэтому файл сохраняется заранее
+            self.image.save(self.image.name, self.image.file, save=False)
+        elif (self.image_width is not None
+              and self.image.name == self._loaded_image):
+            return
+        try:
+            with self.image.storage.open(self.image.name) as file:
+                meta = describe(file)
+                file.seek(0)
+                fingerprint = hash_file(file)
+        except (OSError, SuspiciousFileOperation):
+            meta = fingerprint = None
+        self.image_width, self.image_height, self.image_placeholder = (
+            meta or (None, None, '')
+        )
+        if fingerprint:
+            ImageHash.remember(self.image.name, *fingerprint)
+
+    def save(self, *args, **kwargs):
+        uploaded = bool(self.image) and not self.image._committed
+        self.update_image_meta()
+        if not self._state.adding and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name if self.image else None
+        if uploaded:
+            thumbnails.prebuild_on_commit(self.image.name)
+
+
+class ImageHash(models.Model):
+    """Перцептивный хэш сохранённой картинки и его части для поиска
+    почти одинаковых картинок, см. posts/dhash.py."""
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField()
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    band_0 = models.PositiveIntegerField(db_index=True)
+    band_1 = models.PositiveIntegerField(db_index=True)
+    band_2 = models.PositiveIntegerField(db_index=True)
+    band_3 = models.PositiveIntegerField(db_index=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def remember(cls, name, value, width, height):
+        defaults = {'value': value, 'width': width, 'height': height}
+        for band, part in enumerate(bands(value)):
+            defaults[f'band_{band}'] = part
+        cls.objects.update_or_create(name=name, defaults=defaults)
+
+    @classmethod
+    def similar(cls, value, max_distance=IMAGE_DUPLICATE_DISTANCE):
+        """Картинки не дальше max_distance от хэша, ближние первыми.
+
+        Кандидаты ищутся по индексам частей хэша; при max_distance
+        меньше BANDS ни одна подходящая картинка не пропускается.
+        """
+        query = models.Q()
+        for band, part in enumerate(bands(value)):
+            query |= models.Q(**{f'band_{band}': part})
+        found = [(hamming(value, image.value), image)
+                 for image in cls.objects.filter(query)]
+        return [image for distance, image in sorted(
+            found, key=lambda pair: (pair[0], -pair[1].width)
+        ) if distance <= max_distance]
+
+
+class UserStats(models.Model):
+    """Счётчики постов и подписок пользователя."""
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="stats")
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'Счётчики {self.user}'
+
+    @staticmethod
+    def count_for(user_id):
+        """Считает значения счётчиков заново по таблицам."""
+        return {
+            'posts_count': Post.objects.filter(author_id=user_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=user_id).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id).count(),
+        }
+
+    @classmethod
+    def for_user(cls, user):
+        """Счётчики пользователя; недостающая строка считается один раз."""
+        try:
+            return cls.objects.get(user=user)
+        except cls.DoesNotExist:
+            stats, _ = cls.objects.get_or_create(
+                user=user, defaults=cls.count_for(user.pk)
+            )
+            return stats
 
 
 class Comment(models.Model):
@@ -54,6 +292,17 @@ class Comment(models.Model):
     class Meta:
         ordering = ["-created"]
 
+    @property
+    def author_url(self):
+        return url_for('profile', self.author.username)
+
+    @property
+    def delete_url(self):
+        # post.comments проставляет комментариям тот же объект поста,
+        # без запроса на каждый комментарий
+        return url_for('comment_del', self.post.author.username,
+                       self.post_id, self.id)
+
 
 class Follow(models.Model):
     class Meta:
@@ -76,6 +325,48 @@ class Follow(models.Model):
         verbose_name='Автор - на кого подписываются',
         related_name='following'
     )
+    fanout = models.BooleanField(
+        default=True,
+        verbose_name='Посты автора раскладываются в ленту при записи'
+    )
 
     def __str__(self):
         return f'Результат: {self.user}  подписался на {self.author}'
+
+
+class FeedItem(models.Model):
+    """Запись материализованной ленты подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ["-pub_date", "-post"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"],
+                name="unique_feed_item",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"],
+                         name="feed_user_date_idx"),
+            models.Index(fields=["user", "author"],
+                         name="feed_user_author_idx"),
+        ]
+
+    def __str__(self):
+        return f'Лента {self.user}: {self.post}'
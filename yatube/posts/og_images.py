@@ -0,0 +1,155 @@
+"""Картинки для превью ссылок на пост (og:image).
+
+Картинка 1200x630 собирается из превью картинки поста, имени автора и
+начала текста. Строится она не при запросе, а в пуле процессов после
+сохранения поста (build_on_commit) или командой build_og_images, и
+кладётся в медиа как обычный файл og/ab/cd/<хэш>.jpg; имя файла
+записывается в Post.og_image. Хэш берётся от всего, что видно на
+картинке, поэтому правка поста даёт новый адрес, а правка, которая
+картинку не меняет, ничего не строит. Краулер получает готовый файл.
+"""
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from . import og_worker, page_cache, thumbnails
+from .storage import sharded
+
+OG_IMAGE_WORKERS = getattr(settings, 'OG_IMAGE_WORKERS', 1)
+OG_IMAGE_FONT = getattr(settings, 'OG_IMAGE_FONT', 'DejaVuSans.ttf')
+OG_IMAGE_BOLD_FONT = getattr(settings, 'OG_IMAGE_BOLD_FONT',
+                             'DejaVuSans-Bold.ttf')
+DIRECTORY = 'og'
+SIZE = (1200, 630)
+PADDING = 48
+PICTURE_HEIGHT = 380
+BACKGROUND = '#f8f9fa'
+TEXT_COLOR = '#212529'
+MUTED_COLOR = '#6c757d'
+# меняется вместе с вёрсткой, чтобы все картинки построились заново
+LAYOUT_VERSION = 1
+
+_pool = None
+
+
+def image_name(post):
+    """Имя файла по всему, что видно на картинке."""
+    digest = hashlib.sha256('\n'.join([
+        str(LAYOUT_VERSION), post.author.username, post.text,
+        post.image.name if post.image else '',
+    ]).encode()).hexdigest()
+    return sharded(DIRECTORY, f'{digest[:32]}.jpg')
+
+
+def load_font(name, size):
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        # шрифта нет в системе
+        return ImageFont.load_default(size)
+
+
+def wrap(draw, text, font, width, max_lines):
+    """Строки текста по ширине; не поместившееся заменяется многоточием."""
+    lines = []
+    line = ''
+    for word in text.split():
+        candidate = f'{line} {word}' if line else word
+        if draw.textlength(candidate, font=font) <= width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = word
+        if len(lines) == max_lines:
+            break
+    else:
+        if line:
+            lines.append(line)
+        return lines
+    lines = lines[:max_lines]
+    last = lines[-1]
+    while last and draw.textlength(f'{last}…', font=font) > width:
+        last = last[:-1]
+    lines[-1] = f'{last.rstrip()}…'
+    return lines
+
+
+def render(post):
+    """JPEG с картинкой поста сверху, автором и началом текста."""
+    canvas = Image.new('RGB', SIZE, BACKGROUND)
+    top = PADDING
+    if post.image:
+        thumb = thumbnails.get_or_create(post.image.name, 'card')
+        with thumb.storage.open(thumb.name) as file:
+            picture = Image.open(file).convert('RGB')
+            canvas.paste(ImageOps.fit(picture, (SIZE[0], PICTURE_HEIGHT),
+                                      Image.LANCZOS))
+        top = PICTURE_HEIGHT + PADDING // 2
+    draw = ImageDraw.Draw(canvas)
+    author_font = load_font(OG_IMAGE_BOLD_FONT, 40)
+    draw.text((PADDING, top), f'@{post.author.username}', font=author_font,
+              fill=MUTED_COLOR)
+    text_font = load_font(OG_IMAGE_FONT, 36)
+    line_height = 48
+    top += 64
+    max_lines = (SIZE[1] - top - PADDING // 2) // line_height
+    for line in wrap(draw, post.text, text_font, SIZE[0] - 2 * PADDING,
+                     max_lines):
+        draw.text((PADDING, top), line, font=text_font, fill=TEXT_COLOR)
+        top += line_height
+    output = BytesIO()
+    canvas.save(output, 'JPEG', quality=85, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def build(post_id):
+    """Строит картинку поста, если её ещё нет, и записывает её имя."""
+    from .models import Post
+    post = (Post.objects.select_related('author')
+            .filter(pk=post_id).first())
+    if post is None:
+        return None
+    name = image_name(post)
+    if post.og_image == name:
+        return name
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(render(post)))
+    # UPDATE, а не save(): сигналы правки поста здесь не нужны. Пока
+    # картинка строилась, пост могли поправить, и новая задача уже
+    # записала бы свежую картинку: старый снимок её не затирает. Условие -
+    # то, из чего картинка собрана, а не version, которую двигают и
+    # комментарии, не заказывающие новую картинку
+    unchanged = Post.objects.filter(
+        pk=post_id, text=post.text, image=post.image.name,
+        author__username=post.author.username,
+    )
+    if not unchanged.update(og_image=name):
+        return None
+    page_cache.invalidate()
+    return name
+
+
+def build_on_commit(post_id):
+    """После коммита отправляет пост строить картинку в пул процессов."""
+    global _pool
+    # читается при вызове, чтобы тесты могли включить её override_settings
+    if not getattr(settings, 'OG_IMAGES', True):
+        return
+    if _pool is None:
+        # spawn: форк процесса с потоками и открытыми соединениями опасен
+        _pool = ProcessPoolExecutor(
+            OG_IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=og_worker.init,
+            initargs=({connection.alias: connection.settings_dict['NAME']
+                       for connection in connections.all()},),
+        )
+    transaction.on_commit(lambda: _pool.submit(og_worker.build, post_id))
@@ -0,0 +1,30 @@
+"""Точка входа процессов пула og:image, см. posts/og_images.py.
+
+Процесс, запущенный через spawn, импортирует этот модуль до настройки
+Django, поэтому модели и всё, что их импортирует, загружаются только
+внутри функций.
+"""
+import logging
+
+import django
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def init(names=None):
+    django.setup()
+    # база та же, что у запустившего пул процесса, под тестами - тестовая
+    for alias, name in (names or {}).items():
+        connections[alias].settings_dict['NAME'] = name
+
+
+def build(post_id):
+    from . import og_images
+    try:
+        return og_images.build(post_id)
+    except Exception:
+        # без картинки ссылка просто покажется без превью
+        logger.exception('Не удалось построить og:image поста %s', post_id)
+    finally:
+        connections.close_all()
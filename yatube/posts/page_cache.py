@@ -0,0 +1,68 @@
+"""Кэш целых страниц для анонимных посетителей.
+
+Ответ кэшируется по пути с query string и «поколению» кэша, которое
+увеличивается при любом изменении постов, комментариев, групп и
+подписок, так что устаревшие страницы просто перестают читаться.
+Запрос без cookie сессии обслуживается без обращения к сессии: ответ не
+получает Vary: Cookie, и ключ кэша не дробится по значениям cookie.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 5)
+GENERATION_KEY = 'page_cache:generation'
+
+
+def generation():
+    gen = cache.get(GENERATION_KEY)
+    if gen is None:
+        # после вытеснения счётчик начинается заново с текущего времени,
+        # чтобы не совпасть с поколением уже лежащих в кэше страниц
+        cache.add(GENERATION_KEY, time.time_ns() // 1000, None)
+        gen = cache.get(GENERATION_KEY)
+    return gen
+
+
+def invalidate():
+    """Делает все закэшированные страницы устаревшими."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        generation()
+
+
+def page_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page:{generation()}:{path}'
+
+
+def cache_anonymous(view):
+    """Кэширует ответы view на анонимные GET и HEAD запросы."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            # сессии нет - посетитель анонимен, сессию не трогаем
+            request.user = AnonymousUser()
+        elif request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        key = page_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, (response.content, response['Content-Type']),
+                      PAGE_CACHE_TIMEOUT)
+        return response
+    # попадание в кэш не должно открывать транзакцию ATOMIC_REQUESTS
+    return transaction.non_atomic_requests(wrapper)
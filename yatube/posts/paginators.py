@@ -0,0 +1,103 @@
+"""Пагинация лент: номерная (?page=N) и курсорная (?before=<курсор>).
+
+Курсор - это пара (pub_date, id) последнего поста на странице.
+Следующая страница выбирается условием «строго раньше курсора» по
+индексу, без COUNT(*) и OFFSET, поэтому глубокая страница стоит столько
+же, сколько первая, и не съезжает, когда сверху появляются новые посты.
+"""
+import datetime as dt
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils import timezone
+
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=timezone.utc)
+# id поста - знаковое 64-битное целое в БД
+MAX_ID = 2 ** 63 - 1
+
+
+def encode_cursor(post):
+    """Курсор вида '<микросекунды с начала эпохи>_<id>'."""
+    micros = (post.pub_date - EPOCH) // dt.timedelta(microseconds=1)
+    return f'{micros}_{post.id}'
+
+
+def decode_cursor(cursor):
+    """Возвращает (pub_date, id) или None для испорченного курсора."""
+    try:
+        micros, post_id = (int(part) for part in cursor.split('_'))
+        # дата за пределами datetime даёт OverflowError
+        pub_date = EPOCH + dt.timedelta(microseconds=micros)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    if not 0 < post_id <= MAX_ID:
+        return None
+    return pub_date, post_id
+
+
+class CursorPage(Page):
+    """Страница курсорной ленты, совместимая с шаблонами Page."""
+
+    def __init__(self, object_list, paginator, before, has_next):
+        super().__init__(object_list, None, paginator)
+        self.before = before
+        self._has_next = has_next
+        self.next_cursor = (encode_cursor(object_list[-1])
+                            if has_next else None)
+
+    def __repr__(self):
+        return f'<Page before {self.before}>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return True
+
+
+class CursorPaginator:
+    """Курсорный пагинатор для выборки, упорядоченной по (-дата, -id).
+
+    Поле даты берётся из первого ключа сортировки выборки (например,
+    feed_items__pub_date для ленты подписок), а значения курсора - из
+    pub_date и id самих постов.
+    """
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+        ordering = (object_list.query.order_by
+                    or object_list.model._meta.ordering)
+        self.date_field = ordering[0].lstrip('-')
+
+    def get_page(self, before):
+        posts = self.object_list
+        key = decode_cursor(before)
+        if key is not None:
+            pub_date, post_id = key
+            # условие на <= даёт поиск по индексу, а не его скан сверху
+            posts = posts.filter(
+                Q(**{f'{self.date_field}__lte': pub_date}),
+                Q(**{f'{self.date_field}__lt': pub_date})
+                | Q(id__lt=post_id)
+            )
+        posts = list(posts[:self.per_page + 1])
+        return CursorPage(posts[:self.per_page], self, before,
+                          len(posts) > self.per_page)
+
+
+def paginate(request, object_list, per_page, count=None):
+    """Страница ленты по параметрам запроса ?before= или ?page=.
+
+    Если число постов уже известно (count), COUNT(*) не выполняется.
+    """
+    before = request.GET.get('before')
+    if before:
+        return CursorPaginator(object_list, per_page).get_page(before)
+    paginator = Paginator(object_list, per_page)
+    if count is not None:
+        paginator.count = count
+    page = paginator.get_page(request.GET.get('page'))
+    page.next_cursor = (encode_cursor(page[-1])
+                        if page.has_next() else None)
+    return page
@@ -0,0 +1,43 @@
+"""Размеры картинки поста и заглушка для неё, посчитанные при загрузке.
+
+Лента выводит у картинки width/height и размытую заглушку - крошечную
+копию картинки в data: URI, которую браузер растягивает фоном до
+загрузки превью. Всё это хранится в полях поста, так что при рендере
+ни оригинал, ни превью не открываются, а вёрстка не прыгает.
+"""
+import base64
+from io import BytesIO
+
+from PIL import Image, ImageOps, features
+
+# длинная сторона заглушки; при растягивании браузер сам её размоет
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_FORMAT = 'WEBP' if features.check('webp') else 'PNG'
+PLACEHOLDER_OPTIONS = {'WEBP': {'quality': 40}, 'PNG': {'optimize': True}}
+EXIF_ORIENTATION = 0x0112
+# при этих значениях EXIF картинка повёрнута на 90 градусов
+ROTATED = (5, 6, 7, 8)
+
+
+def describe(file):
+    """Ширина, высота и заглушка картинки или None для не-картинки."""
+    try:
+        image = Image.open(file)
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in ROTATED:
+            width, height = height, width
+        if image.format == 'JPEG':
+            image.draft('RGB', (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BOX)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  or 'transparency' in image.info else 'RGB')
+        output = BytesIO()
+        image.save(output, PLACEHOLDER_FORMAT,
+                   **PLACEHOLDER_OPTIONS[PLACEHOLDER_FORMAT])
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+    data = base64.b64encode(output.getvalue()).decode('ascii')
+    uri = f'data:image/{PLACEHOLDER_FORMAT.lower()};base64,{data}'
+    return width, height, uri
@@ -0,0 +1,189 @@
+"""Полнотекстовый поиск постов по индексу SQLite FTS5.
+
+Таблица posts_post_fts (миграция 0015) хранит основы слов текста поста
+с rowid, равным id поста, и поддерживается триггерами на posts_post.
+Основы считает функция ru_stems, которая регистрируется в каждом
+соединении с SQLite. Запрос проходит через тот же стеммер, поэтому
+«кошками» находит «кошка». Результаты упорядочены по bm25 (rank),
+следующая страница выбирается курсором (rank, rowid), без OFFSET.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .stemmer import WORD, stem, stems
+
+FTS_TABLE = 'posts_post_fts'
+# столько символов текста вокруг первого совпадения попадает в сниппет
+SNIPPET_LENGTH = 200
+# не больше слов в поисковом запросе
+MAX_TERMS = 16
+# триггеры из миграции 0015; SQLite удаляет их вместе с таблицей, когда
+# миграция изменяет поле поста и пересоздаёт posts_post
+TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, stems)
+        VALUES (new.id, ru_stems(new.text));
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF text ON posts_post BEGIN
+        UPDATE {FTS_TABLE} SET stems = ru_stems(new.text)
+        WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON posts_post BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+]
+
+
+@receiver(connection_created)
+def register_functions(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        register_stemmer(connection.connection)
+
+
+@receiver(post_migrate)
+def restore_triggers(sender, using, **kwargs):
+    db = connections[using]
+    if sender.name != 'posts' or db.vendor != 'sqlite':
+        return
+    with db.cursor() as cursor:
+        if FTS_TABLE not in db.introspection.table_names(cursor):
+            return
+        for sql in TRIGGERS:
+            cursor.execute(sql)
+
+
+def register_stemmer(db):
+    """Функция ru_stems, которую вызывают триггеры индекса."""
+    db.create_function('ru_stems', 1, lambda text: stems(text or ''))
+
+
+def fts_query(query):
+    """Запрос MATCH: все основы слов запроса, каждая точно.
+
+    Основа как префикс вернула бы к запросу «кот» и «который», и
+    «котлеты». Каждая основа берётся в кавычки, так что операторы FTS5
+    из ввода пользователя не интерпретируются.
+    """
+    terms = [stem(word) for word in WORD.findall(query)][:MAX_TERMS]
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def encode_cursor(rank, post_id):
+    return f'{rank!r}_{post_id}'
+
+
+def decode_cursor(cursor):
+    """Возвращает (rank, id) или None для испорченного курсора."""
+    try:
+        rank, post_id = cursor.rsplit('_', 1)
+        return float(rank), int(post_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def matching(queryset, query):
+    """Посты выборки, подходящие под запрос, - для поиска в админке."""
+    match = fts_query(query)
+    if not match:
+        return queryset.none()
+    # RawSQL в id__in оборачивается в скобки ещё раз, и SQLite
+    # принимает такой подзапрос за скалярный - берёт только первую строку
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    return queryset.extra(
+        where=[f'{table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+               f'WHERE {FTS_TABLE} MATCH %s)'],
+        params=[match],
+    )
+
+
+def snippet(text, query):
+    """Отрывок текста вокруг первого совпадения с подсветкой <mark>."""
+    wanted = {stem(word) for word in WORD.findall(query)}
+    words = [(found, stem(found.group())) for found in WORD.finditer(text)]
+    hits = [found for found, word_stem in words
+            if word_stem in wanted]
+    start = 0
+    if hits:
+        start = max(0, hits[0].start() - SNIPPET_LENGTH // 4)
+        # не режем слово посередине
+        space = text.rfind(' ', 0, start)
+        start = space + 1 if space > 0 else 0
+    end = min(len(text), start + SNIPPET_LENGTH)
+    parts, position = [], start
+    for found in hits:
+        if found.start() < start or found.end() > end:
+            continue
+        parts.append(escape(text[position:found.start()]))
+        parts.append(f'<mark>{escape(found.group())}</mark>')
+        position = found.end()
+    parts.append(escape(text[position:end]))
+    html = ''.join(parts)
+    if start > 0:
+        html = '&hellip;' + html
+    if end < len(text):
+        html += '&hellip;'
+    return mark_safe(re.sub(r'\s+', ' ', html))
+
+
+class SearchPage:
+    """Страница результатов поиска: посты, сниппеты и курсор дальше."""
+
+    def __init__(self, posts, has_next, next_cursor):
+        self.object_list = posts
+        self._has_next = has_next
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+
+def search(queryset, query, per_page, after=None):
+    """Страница результатов по релевантности, начиная после курсора.
+
+    Сначала индекс отдаёт id и rank одного окна результатов, затем посты
+    загружаются из выборки одним запросом по первичному ключу.
+    """
+    match = fts_query(query)
+    if not match:
+        return SearchPage([], False, None)
+    sql = f'SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    params = [match]
+    key = decode_cursor(after)
+    if key is not None:
+        sql += ' AND (rank > %s OR (rank = %s AND rowid > %s))'
+        params += [key[0], key[0], key[1]]
+    sql += ' ORDER BY rank, rowid LIMIT %s'
+    params.append(per_page + 1)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        hits = cursor.fetchall()
+    has_next = len(hits) > per_page
+    hits = hits[:per_page]
+    posts = queryset.in_bulk([post_id for post_id, _ in hits])
+    found = []
+    for post_id, _ in hits:
+        # пост мог пропасть между запросами
+        if post_id in posts:
+            post = posts[post_id]
+            post.snippet = snippet(post.text, query)
+            found.append(post)
+    next_cursor = None
+    if has_next:
+        last_id, last_rank = hits[-1]
+        next_cursor = encode_cursor(last_rank, last_id)
+    return SearchPage(found, has_next, next_cursor)
@@ -0,0 +1,75 @@
+"""Стеммер Портера (Snowball) для русского языка.
+
+Встроенные токенизаторы SQLite FTS5 не умеют русскую морфологию,
+поэтому в индекс поиска кладутся уже обрезанные до основы слова,
+и запрос проходит через тот же стеммер.
+http://snowball.tartarus.org/algorithms/russian/stemmer.html
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+WORD = re.compile(r'\w+')
+
+PERFECTIVE_GERUND = re.compile(
+    r'((?<=[ая])(в|вши|вшись)|(ив|ивши|ившись|ыв|ывши|ывшись))$'
+)
+REFLEXIVE = re.compile(r'(ся|сь)$')
+ADJECTIVE = (r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому'
+             r'|их|ых|ую|юю|ая|яя|ою|ею)')
+PARTICIPLE = r'((?<=[ая])(ем|нн|вш|ющ|щ)|ивш|ывш|ующ)'
+ADJECTIVAL = re.compile(PARTICIPLE + '?' + ADJECTIVE + '$')
+VERB = re.compile(
+    r'((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)'
+    r'|(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло'
+    r'|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю))$'
+)
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем'
+    r'|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+DERIVATIONAL = re.compile(r'(ост|ость)$')
+SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+
+
+def _region_start(word, start):
+    """Начало области после первой согласной, идущей за гласной."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    match = re.search(f'[{VOWELS}]', word)
+    if match is None:
+        return word
+    prefix, rv = word[:match.end()], word[match.end():]
+    r2 = _region_start(word, _region_start(word, 0)) - len(prefix)
+
+    rv, found = PERFECTIVE_GERUND.subn('', rv, count=1)
+    if not found:
+        rv = REFLEXIVE.sub('', rv, count=1)
+        for ending in (ADJECTIVAL, VERB, NOUN):
+            rv, found = ending.subn('', rv, count=1)
+            if found:
+                break
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    match = DERIVATIONAL.search(rv)
+    if match and match.start() >= r2:
+        rv = rv[:match.start()]
+
+    rv, found = SUPERLATIVE.subn('', rv, count=1)
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif not found and rv.endswith('ь'):
+        rv = rv[:-1]
+    return prefix + rv
+
+
+def stems(text):
+    """Основы всех слов текста через пробел, для индекса FTS5."""
+    return ' '.join(stem(word) for word in WORD.findall(text))
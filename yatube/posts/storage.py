@@ -0,0 +1,121 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Загрузка читается по частям: файл одновременно хэшируется и пишется во
+временный файл, а сохраняется под именем из хэша, например
+posts/3f/2a/3f2a...9c.jpg. Вложенные каталоги по первым символам хэша
+держат в одном каталоге не больше нескольких тысяч файлов даже при
+миллионах картинок. Если такой файл уже есть, его имя просто
+возвращается: одинаковые картинки лежат на диске в одном экземпляре и
+перекодируются один раз.
+
+Перед записью картинка поворачивается по EXIF, уменьшается до
+IMAGE_MAX_SIZE по длинной стороне и перекодируется без метаданных
+(EXIF с координатами съёмки, комментарии); цветовой профиль ICC
+сохраняется. Анимации и неизвестные форматы сохраняются как есть.
+
+Файл под таким именем никогда не меняется, поэтому медиа можно отдавать
+с Cache-Control на год (MEDIA_CACHE_MAX_AGE).
+"""
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps
+
+IMAGE_MAX_SIZE = getattr(settings, 'IMAGE_MAX_SIZE', 2560)
+IMAGE_QUALITY = getattr(settings, 'IMAGE_QUALITY', 85)
+# загрузки больше этого размера при хэшировании уходят из памяти на диск
+SPOOL_SIZE = 4 * 1024 * 1024
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+HASH_LENGTH = 32
+SAVE_OPTIONS = {
+    'JPEG': {'quality': IMAGE_QUALITY, 'optimize': True,
+             'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': IMAGE_QUALITY, 'method': 4},
+}
+
+
+def sharded(directory, filename):
+    """Путь файла в каталогах по первым символам имени: ab/cd/abcd..."""
+    return os.path.join(directory, filename[:2], filename[2:4], filename)
+
+
+def detect_format(raw):
+    """Формат картинки, которую стоит перекодировать, или None.
+
+    Читается только заголовок файла, пиксели не декодируются.
+    """
+    try:
+        image = Image.open(raw)
+        animated = getattr(image, 'n_frames', 1) > 1
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        raw.seek(0)
+    if image.format not in SAVE_OPTIONS or animated:
+        return None
+    return image.format
+
+
+def normalize(raw, image_format):
+    """Уменьшенная и очищенная от метаданных картинка или None."""
+    try:
+        image = Image.open(raw)
+        if image_format == 'JPEG':
+            image.draft(image.mode, (IMAGE_MAX_SIZE, IMAGE_MAX_SIZE))
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((IMAGE_MAX_SIZE, IMAGE_MAX_SIZE), Image.LANCZOS,
+                        reducing_gap=3.0)
+        output = BytesIO()
+        options = dict(SAVE_OPTIONS[image_format])
+        if icc_profile:
+            options['icc_profile'] = icc_profile
+        image.save(output, image_format, **options)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        raw.seek(0)
+    return output.getvalue()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, который называет файлы по хэшу содержимого."""
+
+    def touch(self, name):
+        """Обновляет дату файла, который снова начали использовать:
+        collect_media не удалит его как ничей."""
+        os.utime(self.path(name))
+
+    def save(self, name, content, max_length=None):
+        if content is None:
+            content = ContentFile(name)
+        if not hasattr(content, 'chunks'):
+            content = ContentFile(content.read())
+        directory, basename = os.path.split(name)
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as raw:
+            digest = hashlib.sha256()
+            for chunk in content.chunks():
+                digest.update(chunk)
+                raw.write(chunk)
+            raw.seek(0)
+            image_format = detect_format(raw)
+            extension = (EXTENSIONS[image_format] if image_format
+                         else os.path.splitext(basename)[1].lower())
+            name = sharded(directory,
+                           digest.hexdigest()[:HASH_LENGTH] + extension)
+            if self.exists(name):
+                # такая картинка уже загружена и обработана
+                self.touch(name)
+                return name.replace('\\', '/')
+            data = image_format and normalize(raw, image_format)
+            return self._save(
+                name, ContentFile(data) if data else File(raw)
+            ).replace('\\', '/')
@@ -0,0 +1,17 @@
+from django import template
+
+from ..cards import render_cards
+from ..models import Post
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Карточки постов страницы (или одного поста) из кэша карточек."""
+    if isinstance(posts, Post):
+        posts = [posts]
+    return render_cards(list(posts),
+                        context.get('user'),
+                        is_index=context.get('is_index'),
+                        from_post_view=context.get('from_post_view'))
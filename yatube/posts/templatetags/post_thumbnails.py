@@ -0,0 +1,33 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from ..thumbnails import display_size, srcset
+from ..thumbnails import thumbnail_url as build_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(image, spec):
+    """Подписанный адрес превью; картинка строится при первом запросе."""
+    return build_url(image, spec) if image else ''
+
+
+@register.simple_tag
+def thumbnail_srcset(image, spec):
+    """srcset из подписанных адресов копий превью по ширинам."""
+    return srcset(image, spec) if image else ''
+
+
+@register.simple_tag
+def thumbnail_size(post, spec):
+    """(ширина, высота) превью картинки поста по сохранённым размерам."""
+    return display_size(spec, post.image_width, post.image_height)
+
+
+@register.simple_tag(takes_context=True)
+def og_image_url(context, post):
+    """Абсолютный адрес готовой картинки og:image, см. posts/og_images.py."""
+    url = default_storage.url(post.og_image)
+    request = context.get('request')
+    return request.build_absolute_uri(url) if request else url
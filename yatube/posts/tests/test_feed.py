@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from .. import feed
+from ..models import FeedItem, Follow, Post
+
+User = get_user_model()
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.old_post = Post.objects.create(text='старый пост',
+                                           author=cls.author)
+
+    def test_follow_backfills_feed(self):
+        """Подписка заполняет ленту уже написанными постами автора."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(list(feed.feed_for(self.reader)), [self.old_post])
+
+    def test_new_post_fans_out(self):
+        """Новый пост попадает в ленту подписчика при записи."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='новый пост', author=self.author)
+        self.assertTrue(FeedItem.objects.filter(
+            user=self.reader, post=post).exists())
+        self.assertEqual(feed.feed_for(self.reader)[0], post)
+
+    def test_unfollow_trims_feed(self):
+        """Отписка убирает посты автора из ленты."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertFalse(FeedItem.objects.filter(user=self.reader).exists())
+        self.assertEqual(list(feed.feed_for(self.reader)), [])
+
+    def test_popular_author_merged_on_read(self):
+        """Посты автора сверх лимита подписчиков подмешиваются при чтении."""
+        with mock.patch.object(feed, 'FEED_FANOUT_LIMIT', 0):
+            follow = Follow.objects.create(user=self.reader,
+                                           author=self.author)
+        self.assertFalse(follow.fanout)
+        post = Post.objects.create(text='новый пост', author=self.author)
+        self.assertFalse(FeedItem.objects.filter(user=self.reader).exists())
+        self.assertEqual(list(feed.feed_for(self.reader)),
+                         [post, self.old_post])
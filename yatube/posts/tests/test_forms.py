@@ -1,11 +1,22 @@
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.admin.sites import site
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import (Client, RequestFactory, TestCase,
+                         override_settings)
 from django.urls import reverse
+from PIL import Image, ImageDraw
 
+from ..dhash import dhash, hamming
 from ..forms import PostForm
-from ..models import Post
+from ..models import DUPLICATE_TEXT_ERROR, Group, ImageHash, Post
 
 User = get_user_model()
+MEDIA_ROOT = tempfile.mkdtemp()
 
 
 class PostCreateFormTests(TestCase):
@@ -68,3 +79,195 @@ class PostCreateFormTests(TestCase):
         )
         self.assertEqual(Post.objects.count(), post_count)
         self.assertEqual(response.status_code, 200)
+
+    def test_edit_keeps_own_text(self):
+        """Пост можно сохранить, не меняя его текст."""
+        post = PostCreateFormTests.post
+        response = self.authorized_client.post(reverse(
+            'post_edit', kwargs={'username': self.user.username,
+                                 'post_id': post.id}),
+            data={'text': post.text})
+        self.assertRedirects(response, reverse(
+            'post', kwargs={'username': self.user.username,
+                            'post_id': post.id}))
+
+    def test_cant_create_text_differing_in_spaces(self):
+        """Текст, отличающийся только пробелами, тоже не уникален."""
+        form = PostForm(data={'text': '  Тестовый   пост '})
+        self.assertFalse(form.is_valid())
+        self.assertIn('text', form.errors)
+
+    def test_admin_cant_save_existing_text(self):
+        """Форма админки тоже проверяет уникальность текста."""
+        request = RequestFactory().get('/admin/')
+        request.user = User.objects.create_superuser('admin', '', 'pass')
+        form_class = site._registry[Post].get_form(request)
+        form = form_class(data={'text': 'Тестовый пост',
+                                'author': self.user.pk,
+                                'pub_date_0': '2020-01-01',
+                                'pub_date_1': '00:00:00'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['text'], [DUPLICATE_TEXT_ERROR])
+
+    def test_concurrent_duplicate_gives_form_error(self):
+        """Дубль, прошедший проверку формы (параллельная отправка),
+        упирается в уникальный индекс и показывается ошибкой формы."""
+        post = Post.objects.create(text='Другой пост', author=self.user)
+        edit_url = reverse('post_edit', kwargs={'username': 'kek1',
+                                                'post_id': post.id})
+        with mock.patch.object(Post, 'validate_unique'):
+            for url in (reverse('new_post'), edit_url):
+                with self.subTest(url=url):
+                    response = self.authorized_client.post(
+                        url, data={'text': 'Тестовый пост'})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertFormError(response, 'form', 'text',
+                                         DUPLICATE_TEXT_ERROR)
+        self.assertEqual(Post.objects.filter(text='Тестовый пост').count(), 1)
+
+    def test_legacy_duplicate_editable(self):
+        """Старый повтор текста без хэша правится, пока текст тот же;
+        новый текст получает хэш и проверку."""
+        legacy = Post.objects.create(text='Старый повтор', author=self.user)
+        Post.objects.filter(pk=legacy.pk).update(text='Тестовый пост',
+                                                 text_hash=None)
+        Post.objects.get(pk=legacy.pk).save()
+        group = Group.objects.create(title='Группа', slug='legacy')
+        form = PostForm(data={'text': 'Тестовый пост', 'group': group.pk},
+                        instance=Post.objects.get(pk=legacy.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.group, group)
+        self.assertIsNone(legacy.text_hash)
+        form = PostForm(data={'text': 'Новый текст'},
+                        instance=Post.objects.get(pk=legacy.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        legacy.refresh_from_db()
+        self.assertIsNotNone(legacy.text_hash)
+
+
+def plain(size, color, text=None):
+    """Однотонная картинка PNG, с надписью или без."""
+    image = Image.new('RGB', size, color)
+    if text:
+        ImageDraw.Draw(image).text((20, size[1] // 2), text, fill='black')
+    buffer = BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def picture(size, image_format='JPEG', quality=90, shape='ellipse',
+            mark=None):
+    """Картинка с градиентом и фигурой, пересохранённая в нужном виде;
+    mark - чёрный прямоугольник поверх."""
+    image = Image.linear_gradient('L').resize((400, 300)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    getattr(draw, shape)((60, 40, 260, 220), fill='orange')
+    if mark:
+        draw.rectangle(mark, fill='black')
+    buffer = BytesIO()
+    image.resize(size, Image.LANCZOS).save(buffer, image_format,
+                                           quality=quality)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageDuplicateTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reposter')
+        self.client.force_login(self.user)
+
+    def publish(self, text, content):
+        self.client.post(reverse('new_post'), {
+            'text': text,
+            'image': SimpleUploadedFile('photo.jpg', content,
+                                        content_type='image/jpeg'),
+        })
+        return Post.objects.get(text=text)
+
+    def test_dhash_survives_resize_and_recompression(self):
+        original = dhash(Image.open(BytesIO(picture((400, 300)))))
+        copy = dhash(Image.open(BytesIO(picture((200, 150), quality=40))))
+        other = dhash(Image.open(BytesIO(picture((400, 300),
+                                                 shape='rectangle'))))
+        self.assertLessEqual(hamming(original, copy), 3)
+        self.assertGreater(hamming(original, other), 3)
+
+    def test_repost_keeps_own_file(self):
+        """Уменьшенная пересжатая копия сохраняется своим файлом и
+        отмечается ссылкой на уже загруженную картинку."""
+        first = self.publish('оригинал', picture((400, 300)))
+        second = self.publish('репост', picture((200, 150), quality=40))
+        self.assertNotEqual(second.image.name, first.image.name)
+        self.assertEqual(second.image_width, 200)
+        self.assertEqual(second.repost_of, first.image.name)
+        self.assertEqual(first.repost_of, '')
+        self.assertEqual(ImageHash.objects.count(), 2)
+
+    def test_small_detail_keeps_own_file(self):
+        """Картинка, отличающаяся мелкой деталью, даже если сравнение её
+        не заметило, показывает свои пиксели, а не чужой файл."""
+        first = self.publish('карта 1', picture((400, 300)))
+        second = self.publish('карта 2',
+                              picture((400, 300), mark=(330, 260, 332, 262)))
+        self.assertNotEqual(second.image.name, first.image.name)
+        with Image.open(second.image.path) as image:
+            self.assertLess(image.convert('L').getpixel((331, 261)), 80)
+
+    def test_larger_or_different_image_stored(self):
+        first = self.publish('маленькая', picture((200, 150)))
+        larger = self.publish('большая', picture((400, 300)))
+        other = self.publish('другая',
+                             picture((200, 150), shape='rectangle'))
+        self.assertNotEqual(larger.image.name, first.image.name)
+        self.assertEqual(larger.repost_of, first.image.name)
+        self.assertEqual(other.repost_of, '')
+        self.assertEqual(ImageHash.objects.count(), 3)
+
+    def test_flat_images_not_reposts(self):
+        """У однотонных картинок одинаковый пустой хэш, но это не копии."""
+        self.publish('красная', plain((400, 300), 'red'))
+        self.publish('синяя', plain((200, 150), 'blue'))
+        self.publish('белая', plain((800, 600), 'white'))
+        self.publish('скриншот', plain((800, 600), 'white', 'Важный текст'))
+        self.assertFalse(Post.objects.exclude(repost_of='').exists())
+
+    def test_different_pixels_not_repost(self):
+        """Близкий хэш без совпадения пикселей - не копия."""
+        self.publish('оригинал', picture((400, 300)))
+        marked = picture((200, 150), mark=(330, 260, 360, 280))
+        self.assertLessEqual(
+            hamming(dhash(Image.open(BytesIO(picture((400, 300))))),
+                    dhash(Image.open(BytesIO(marked)))), 3)
+        second = self.publish('с пометкой', marked)
+        self.assertEqual(second.repost_of, '')
+
+    def test_new_image_resets_repost(self):
+        """Замена картинки при правке пересчитывает отметку репоста."""
+        self.publish('оригинал', picture((400, 300)))
+        post = self.publish('репост', picture((200, 150), quality=40))
+        self.client.post(
+            reverse('post_edit', kwargs={'username': 'reposter',
+                                         'post_id': post.id}),
+            {'text': 'репост',
+             'image': SimpleUploadedFile('other.jpg',
+                                         picture((200, 150),
+                                                 shape='rectangle'),
+                                         content_type='image/jpeg')})
+        post.refresh_from_db()
+        self.assertEqual(post.repost_of, '')
+
+    def test_lookup_by_band_index(self):
+        """Похожие ищутся одним запросом по индексам частей хэша."""
+        first = self.publish('оригинал', picture((400, 300)))
+        value = dhash(Image.open(BytesIO(picture((300, 225)))))
+        with self.assertNumQueries(1):
+            found = ImageHash.similar(value)
+        self.assertEqual([image.name for image in found], [first.image.name])
@@ -1,5 +1,8 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
-from ..models import Post, Group
+from ..models import Comment, Follow, Post, Group, UserStats
 from django.contrib.auth import get_user_model
 from datetime import datetime
 
@@ -43,3 +46,73 @@ class GroupModelTest(TestCase):
         self.assertEqual(expected_object_name,
                          str(group),
                          'ошибка в __str__  модели group')
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Counted')
+        cls.reader = User.objects.create_user(username='Reader')
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются при создании и удалении записей."""
+        UserStats.for_user(self.author)
+        UserStats.for_user(self.reader)
+        post = Post.objects.create(text='пост', author=self.author)
+        Comment.objects.create(post=post, text='коммент', author=self.reader)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 1)
+        follow.delete()
+        post.comments.all().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 0)
+
+    def test_edit_keeps_comment_count(self):
+        """Сохранение поста не затирает счётчик комментариев."""
+        post = Post.objects.create(text='пост', author=self.author)
+        Comment.objects.create(post=post, text='коммент', author=self.reader)
+        post.text = 'правка'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+    def test_recount_stats_repairs_counters(self):
+        """Команда recount_stats чинит разошедшиеся счётчики."""
+        post = Post.objects.create(text='пост', author=self.author)
+        Comment.objects.create(post=post, text='коммент', author=self.reader)
+        Post.objects.filter(pk=post.pk).update(comment_count=7)
+        UserStats.objects.update_or_create(
+            user=self.author, defaults={'posts_count': 5})
+        call_command('recount_stats', batch_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 1)
+        # версия растёт только у поста с неверным счётчиком: его
+        # закэшированная карточка устарела
+        version = post.version
+        call_command('recount_stats', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.version, version)
+        Post.objects.filter(pk=post.pk).update(comment_count=7)
+        call_command('recount_stats', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.version, version + 1)
+        # недостающая строка счётчиков создаётся заново
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('recount_stats', stdout=StringIO())
+        stats = UserStats.objects.get(user=self.reader)
+        self.assertEqual((stats.posts_count, stats.following_count), (0, 1))
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 1)
@@ -0,0 +1,98 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import search
+from ..models import Post
+from ..stemmer import stem
+
+User = get_user_model()
+
+
+class StemmerTests(TestCase):
+    def test_word_forms_share_stem(self):
+        """Разные формы слова сводятся к одной основе."""
+        for forms in (('кошка', 'кошки', 'кошкой', 'кошками'),
+                      ('бегать', 'бегал'),
+                      ('Ёлка', 'елкой')):
+            with self.subTest(forms=forms):
+                self.assertEqual(len({stem(word) for word in forms}), 1)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='writer')
+        cls.cat = Post.objects.create(
+            text='Вчера во дворе я видел рыжую кошку.', author=cls.author)
+        cls.cats = Post.objects.create(
+            text='Кошки, кошками, о кошках: всё про кошек.',
+            author=cls.author)
+        cls.dog = Post.objects.create(text='Собака лаяла на прохожих.',
+                                      author=cls.author)
+
+    def found(self, query, **kwargs):
+        return list(search.search(Post.objects, query, 10, **kwargs))
+
+    def test_finds_other_word_forms(self):
+        """Поиск находит пост по другой форме слова."""
+        self.assertEqual(set(self.found('кошками')), {self.cat, self.cats})
+        self.assertEqual(self.found('собаки'), [self.dog])
+        self.assertEqual(self.found('жираф'), [])
+
+    def test_stem_is_not_prefix(self):
+        """Короткое слово не находит слова, которые с него начинаются."""
+        post = Post.objects.create(text='Человек, который ел котлеты.',
+                                   author=self.author)
+        self.assertEqual(self.found('кот'), [])
+        self.assertEqual(self.found('котлетой'), [post])
+
+    def test_most_relevant_first(self):
+        """Пост, где слово встречается чаще, идёт первым."""
+        self.assertEqual(self.found('кошка')[0], self.cats)
+
+    def test_cursor_pages(self):
+        """Курсор отдаёт следующую страницу без повторов."""
+        first = search.search(Post.objects, 'кошка', 1)
+        self.assertTrue(first.has_next())
+        second = search.search(Post.objects, 'кошка', 1,
+                               after=first.next_cursor)
+        self.assertFalse(second.has_next())
+        self.assertEqual(list(first) + list(second), [self.cats, self.cat])
+
+    def test_index_follows_edit_and_delete(self):
+        """Триггеры обновляют индекс при правке и удалении поста."""
+        post = Post.objects.get(pk=self.dog.pk)
+        post.text = 'Теперь здесь про попугаев.'
+        post.save()
+        self.assertEqual(self.found('собака'), [])
+        self.assertEqual(self.found('попугаи'), [post])
+        post.delete()
+        self.assertEqual(self.found('попугай'), [])
+
+    def test_fts_syntax_is_not_interpreted(self):
+        """Операторы FTS5 во вводе не ломают запрос."""
+        self.assertEqual(self.found('собака OR "кошка" NEAR(*'), [])
+        self.assertEqual(self.found('"*^'), [])
+
+    def test_snippet_marks_matches(self):
+        """Сниппет подсвечивает совпадения и экранирует текст."""
+        html = search.snippet('<b>Рыжие</b> кошки спят', 'кошка')
+        self.assertEqual(
+            html, '&lt;b&gt;Рыжие&lt;/b&gt; <mark>кошки</mark> спят')
+
+    def test_view(self):
+        """Страница поиска показывает найденные посты со сниппетом."""
+        response = self.client.get(reverse('search'), {'q': 'собаку'})
+        self.assertTemplateUsed(response, 'posts/search.html')
+        self.assertEqual(list(response.context['page']), [self.dog])
+        self.assertContains(response, '<mark>Собака</mark>')
+
+    def test_admin_search(self):
+        """Поиск в админке идёт через индекс."""
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/posts/post/', {'q': 'кошкам'})
+        self.assertEqual(set(response.context['cl'].result_list),
+                         {self.cat, self.cats})
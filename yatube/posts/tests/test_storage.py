@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+
+from .. import storage, thumbnails
+from ..models import ImageHash, Post
+
+User = get_user_model()
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00'
+    b'\x01\x00\x00\x01\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+    b'\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
+EXIF_ORIENTATION = 0x0112
+
+
+def camera_jpeg(size, orientation=None):
+    image = Image.new('RGB', size, 'olive')
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera maker'
+    if orientation:
+        exif[EXIF_ORIENTATION] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = storage.ContentAddressedStorage(self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def save(self, name, content):
+        return self.storage.save(name, SimpleUploadedFile(name, content))
+
+    def open(self, name):
+        with self.storage.open(name) as stored:
+            image = Image.open(BytesIO(stored.read()))
+            image.load()
+        return image
+
+    def test_same_content_stored_once(self):
+        """Одинаковые загрузки получают одно имя и один файл."""
+        first = self.save('posts/cat.jpg', camera_jpeg((40, 30)))
+        second = self.save('posts/other-name.jpg', camera_jpeg((40, 30)))
+        self.assertEqual(first, second)
+        self.assertRegex(
+            first, r'^posts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{28}\.jpg$'
+        )
+        directory = os.path.dirname(self.storage.path(first))
+        self.assertEqual(os.listdir(directory), [os.path.basename(first)])
+
+    def test_large_photo_normalized(self):
+        """Снимок уменьшается, поворачивается по EXIF и теряет EXIF."""
+        # ориентация 6: камеру держали вертикально
+        name = self.save('posts/photo.jpeg',
+                         camera_jpeg((4000, 3000), orientation=6))
+        image = self.open(name)
+        self.assertEqual(image.size, (storage.IMAGE_MAX_SIZE * 3 // 4,
+                                      storage.IMAGE_MAX_SIZE))
+        self.assertNotIn('exif', image.info)
+
+    def test_format_from_content(self):
+        """Расширение берётся из формата, а не из имени загрузки."""
+        buffer = BytesIO()
+        Image.new('RGBA', (10, 10)).save(buffer, 'PNG')
+        name = self.save('posts/picture.jpg', buffer.getvalue())
+        self.assertTrue(name.endswith('.png'))
+        self.assertEqual(self.open(name).format, 'PNG')
+
+    def test_other_formats_kept_as_is(self):
+        """GIF сохраняется без перекодирования."""
+        name = self.save('posts/small.GIF', SMALL_GIF)
+        self.assertTrue(name.endswith('.gif'))
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), SMALL_GIF)
+
+
+class ShardMediaTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        os.makedirs(os.path.join(self.media, 'posts'))
+        self.author = User.objects.create_user(username='old-timer')
+
+    def legacy_post(self, name, content, text):
+        with open(os.path.join(self.media, name), 'wb') as legacy:
+            legacy.write(content)
+        return Post.objects.create(text=text, author=self.author, image=name)
+
+    def test_files_moved_and_paths_rewritten(self):
+        """Старые файлы переезжают в каталоги по хэшу, пути в БД меняются."""
+        hashed = 'posts/' + 'ab12' * 8 + '.jpg'
+        with override_settings(MEDIA_ROOT=self.media):
+            first = self.legacy_post('posts/old.gif', SMALL_GIF, 'первый')
+            second = Post.objects.create(text='второй', author=self.author,
+                                         image='posts/old.gif')
+            third = self.legacy_post(hashed, b'jpeg', 'третий')
+            call_command('shard_media', batch_size=1, stdout=StringIO())
+            for post in (first, second, third):
+                post.refresh_from_db()
+                self.assertRegex(post.image.name,
+                                 r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/')
+                self.assertEqual(post.version, 1)
+                self.assertTrue(post.image.storage.exists(post.image.name))
+            self.assertEqual(first.image.name, second.image.name)
+            self.assertEqual(third.image.name,
+                             'posts/ab/12/' + 'ab12' * 8 + '.jpg')
+            with first.image.open() as moved:
+                self.assertEqual(moved.read(), SMALL_GIF)
+            for old in ('posts/old.gif', hashed):
+                self.assertFalse(os.path.exists(
+                    os.path.join(self.media, old)))
+            # перцептивный хэш переходит к новому имени
+            self.assertEqual(
+                set(ImageHash.objects.values_list('name', flat=True)),
+                {first.image.name},
+            )
+
+
+def png(color):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class CollectMediaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        author = User.objects.create_user(username='collector')
+        self.kept, self.orphan = (
+            Post.objects.create(
+                text=text, author=author,
+                image=SimpleUploadedFile(f'{text}.png', png(color)),
+            )
+            for text, color in (('живой', 'red'), ('удалённый', 'blue'))
+        )
+        self.kept_thumb = thumbnails.get_or_create(self.kept.image.name,
+                                                   'card')
+        self.orphan_thumb = thumbnails.get_or_create(self.orphan.image.name,
+                                                     'card')
+        self.orphan.delete()
+        self.stray = os.path.join(self.media, 'cache', 'ff', 'ff', 'x.jpg')
+        os.makedirs(os.path.dirname(self.stray))
+        with open(self.stray, 'wb') as stray:
+            stray.write(b'old')
+        for directory, _, files in os.walk(self.media):
+            for file_name in files:
+                os.utime(os.path.join(directory, file_name), (0, 0))
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media, name))
+
+    def test_orphans_removed_with_thumbnails(self):
+        """Ничьи картинки уходят вместе с превью и записями sorl."""
+        fresh = os.path.join(self.media, 'posts', 'fresh.png')
+        with open(fresh, 'wb') as upload:
+            upload.write(b'uploading')
+        out = StringIO()
+        call_command('collect_media', batch_size=1, stdout=out)
+        self.assertTrue(self.exists(self.kept.image.name))
+        self.assertTrue(self.exists(self.kept_thumb.name))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertFalse(self.exists(self.orphan.image.name))
+        self.assertFalse(self.exists(self.orphan_thumb.name))
+        self.assertFalse(os.path.exists(self.stray))
+        self.assertIsNone(thumbnails.built(self.orphan.image.name, 'card'))
+        self.assertTrue(thumbnails.built(self.kept.image.name, 'card'))
+        self.assertEqual(
+            list(ImageHash.objects.values_list('name', flat=True)),
+            [self.kept.image.name],
+        )
+        self.assertIn('Удалено файлов:', out.getvalue())
+
+    def test_dry_run_and_quarantine(self):
+        call_command('collect_media', dry_run=True, stdout=StringIO())
+        self.assertTrue(self.exists(self.orphan.image.name))
+        self.assertTrue(os.path.exists(self.stray))
+        quarantine = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, quarantine, ignore_errors=True)
+        call_command('collect_media', quarantine=quarantine,
+                     stdout=StringIO())
+        self.assertFalse(self.exists(self.orphan.image.name))
+        self.assertTrue(os.path.exists(
+            os.path.join(quarantine, self.orphan.image.name)))
@@ -0,0 +1,484 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+
+from .. import og_images, thumbnails
+from ..thumbnail_engine import MIME_TYPES, Engine
+from ..models import Comment, Post
+
+User = get_user_model()
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00'
+    b'\x01\x00\x00\x01\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+    b'\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def jpeg(size):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'teal').save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+class EngineTests(TestCase):
+    options = {'crop': 'center', 'upscale': True, 'cropbox': None,
+               'colorspace': 'RGB', 'format': 'JPEG',
+               'rounded': None, 'padding': False}
+
+    def test_large_jpeg_decoded_reduced(self):
+        """Большой JPEG декодируется уменьшенным, превью нужного размера."""
+        engine = Engine()
+        image = engine.get_image(jpeg((4000, 3000)))
+        thumb = engine.create(image, (960, 339), dict(self.options))
+        self.assertEqual(image.size, (1000, 750))
+        self.assertEqual(thumb.size, (960, 339))
+
+    def test_small_image_upscaled(self):
+        """Маленькая картинка растягивается до размера превью."""
+        engine = Engine()
+        thumb = engine.create(engine.get_image(jpeg((320, 240))),
+                              (960, 339), dict(self.options))
+        self.assertEqual(thumb.size, (960, 339))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.post = Post.objects.create(
+            text='пост с картинкой',
+            author=User.objects.create_user(username='painter'),
+            image=SimpleUploadedFile('small.gif', SMALL_GIF,
+                                     content_type='image/gif'),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.url = thumbnails.thumbnail_url(self.post.image, 'card')
+        self.specs = sorted(thumbnails.THUMBNAIL_SPECS)
+
+    def test_page_does_not_decode_images(self):
+        """Лента выводит адрес превью, не открывая картинку."""
+        with mock.patch.object(thumbnails, 'get_thumbnail') as generate:
+            response = self.client.get(reverse('index'))
+        generate.assert_not_called()
+        self.assertContains(response, self.url)
+
+    def test_listing_links_built_thumbnails(self):
+        """Готовое превью выводится ссылкой на файл, без view."""
+        thumb = thumbnails.get_or_create(self.post.image.name, 'card')
+        cache.clear()
+        with mock.patch.object(default.kvstore, '_get_raw') as get_raw:
+            response = self.client.get(reverse('index'))
+        get_raw.assert_not_called()
+        self.assertContains(response, thumb.url)
+        self.assertNotContains(response, self.url)
+
+    @unittest.skipUnless(thumbnails.THUMBNAIL_VARIANTS,
+                         'Pillow без поддержки WebP и AVIF')
+    def test_variant_by_accept(self):
+        """View отдаёт лучший формат из принимаемых браузером."""
+        best = MIME_TYPES[thumbnails.THUMBNAIL_VARIANTS[0]]
+        response = self.client.get(
+            self.url, HTTP_ACCEPT='image/avif,image/webp,image/*,*/*')
+        self.assertEqual(response['Content-Type'], best)
+        self.assertEqual(response['Vary'], 'Accept')
+        response = self.client.get(self.url, HTTP_ACCEPT='image/*')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    @unittest.skipUnless(thumbnails.THUMBNAIL_VARIANTS,
+                         'Pillow без поддержки WebP и AVIF')
+    def test_listing_picture_sources(self):
+        """Готовые копии превью выводятся в <picture> со всеми
+        вариантами и ширинами."""
+        thumbnails.prebuild(self.post.image.name)
+        cache.clear()
+        response = self.client.get(reverse('index'))
+        found = thumbnails.built_for([self.post.image.name],
+                                     thumbnails.THUMBNAIL_SPECS)
+        thumbs = [(width, found[(self.post.image.name, spec)])
+                  for width, spec in thumbnails.SRCSET_SPECS['card']]
+        for source in thumbnails.sources(thumbs):
+            for candidate in source['srcset'].split(', '):
+                url = candidate.split()[0]
+                self.assertTrue(thumbs[0][1].storage.exists(
+                    url[len(settings.MEDIA_URL):]))
+            self.assertContains(
+                response,
+                f'<source type="{source["type"]}" '
+                f'srcset="{source["srcset"]}"'
+            )
+
+    def test_listing_srcset(self):
+        """В srcset перечислены все ширины, недостающие - по подписанным
+        адресам."""
+        response = self.client.get(reverse('index'))
+        for width, spec in thumbnails.SRCSET_SPECS['card']:
+            url = thumbnails.thumbnail_url(self.post.image, spec)
+            self.assertContains(response, f'{url} {width}w')
+        response = self.client.get(
+            thumbnails.thumbnail_url(self.post.image, 'card-320'))
+        content = BytesIO(b''.join(response.streaming_content))
+        with Image.open(content) as image:
+            self.assertEqual(image.size, (320, 113))
+
+    def test_upload_prebuilds_thumbnails(self):
+        """Новая картинка отправляется строить превью после коммита."""
+        with mock.patch.object(thumbnails, 'prebuild_on_commit') as later:
+            post = Post.objects.create(
+                text='новый пост с картинкой',
+                author=self.post.author,
+                image=SimpleUploadedFile('new.gif', SMALL_GIF,
+                                         content_type='image/gif'),
+            )
+            post.text = 'правка без новой картинки'
+            post.save()
+        later.assert_called_once_with(post.image.name)
+        thumbnails.prebuild(post.image.name)
+        found = thumbnails.built_for([post.image.name],
+                                     thumbnails.THUMBNAIL_SPECS)
+        self.assertEqual(len(found), len(thumbnails.THUMBNAIL_SPECS))
+
+    def test_prebuild_follows_setting(self):
+        """Фоновая сборка планируется, только если THUMBNAIL_PREBUILD
+        включён в момент вызова."""
+        for enabled in (False, True):
+            with self.subTest(enabled=enabled), \
+                    override_settings(THUMBNAIL_PREBUILD=enabled), \
+                    mock.patch.object(thumbnails.transaction,
+                                      'on_commit') as on_commit:
+                thumbnails.prebuild_on_commit(self.post.image.name)
+                self.assertEqual(on_commit.called, enabled)
+
+    def test_built_many_single_query(self):
+        """Превью нескольких картинок ищутся одним запросом."""
+        second = Post.objects.create(
+            text='ещё пост с картинкой',
+            author=self.post.author,
+            image=SimpleUploadedFile('second.gif', SMALL_GIF,
+                                     content_type='image/gif'),
+        )
+        names = [self.post.image.name, second.image.name]
+        thumbnails.get_or_create(names[0], 'card')
+        cache.clear()
+        with self.assertNumQueries(1):
+            found = thumbnails.built_many(names, 'card')
+        self.assertEqual(list(found), [names[0]])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(thumbnails.built_many(names, 'card')),
+                             [names[0]])
+
+    def test_bad_signature(self):
+        """Превью с чужой подписью или спецификацией не строится."""
+        name = self.post.image.name
+        for spec, signature in (('card', 'forged'),
+                                ('huge', thumbnails.signature('card', name))):
+            with self.subTest(spec=spec):
+                response = self.client.get(reverse('thumbnail', kwargs={
+                    'spec': spec, 'signature': signature, 'name': name}))
+                self.assertEqual(response.status_code, 404)
+
+    def test_built_once(self):
+        """Превью строится при первом запросе, дальше берётся с диска."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
+        content = BytesIO(b''.join(response.streaming_content))
+        with Image.open(content) as image:
+            self.assertEqual(image.size, (960, 339))
+        with mock.patch('sorl.thumbnail.base.default.engine') as engine:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        engine.get_image.assert_not_called()
+
+    def test_coalesce_waits_for_builder(self):
+        """Второй запрос того же превью ждёт, пока первый его строит."""
+        entered = threading.Event()
+
+        def build():
+            with thumbnails.coalesce('card:same.jpg'):
+                entered.set()
+
+        with thumbnails.coalesce('card:same.jpg'):
+            worker = threading.Thread(target=build)
+            worker.start()
+            self.assertFalse(entered.wait(0.1))
+        worker.join()
+        self.assertTrue(entered.is_set())
+
+    def build_thumbnails(self, **options):
+        out = StringIO()
+        # потоки вместо процессов: воркеры видят тестовую БД и моки
+        with mock.patch(
+            'posts.management.commands.build_thumbnails.ProcessPoolExecutor',
+            ThreadPoolExecutor,
+        ):
+            call_command('build_thumbnails', stdout=out, **options)
+        return out.getvalue()
+
+    def test_backfill_dry_run(self):
+        """Пробный запуск только считает недостающие превью."""
+        with mock.patch.object(thumbnails, 'get_or_create') as generate:
+            out = self.build_thumbnails(dry_run=True)
+        generate.assert_not_called()
+        self.assertIn(f'Нужно построить превью: {len(self.specs)}, '
+                      f'уже были: 0', out)
+
+    def test_backfill_builds_missing(self):
+        """Строятся только превью, которых ещё нет в хранилище sorl."""
+        with mock.patch.object(thumbnails, 'get_or_create') as generate:
+            out = self.build_thumbnails(workers=2)
+        self.assertEqual(
+            sorted(call[0] for call in generate.call_args_list),
+            [(self.post.image.name, spec) for spec in self.specs]
+        )
+        self.assertIn(f'Построено превью: {len(self.specs)}, уже были: 0, '
+                      f'ошибок: 0', out)
+        with mock.patch.object(thumbnails, 'built', return_value=True), \
+                mock.patch.object(thumbnails, 'get_or_create') as generate:
+            out = self.build_thumbnails()
+        generate.assert_not_called()
+        self.assertIn(f'Построено превью: 0, уже были: {len(self.specs)}',
+                      out)
+
+    def test_backfill_resumes_after_pk(self):
+        """С --after-pk уже пройденные посты не просматриваются."""
+        out = self.build_thumbnails(dry_run=True, after_pk=self.post.pk)
+        self.assertIn('Нужно построить превью: 0', out)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageMetaTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.post = Post.objects.create(
+            text='пост с фотографией',
+            author=User.objects.create_user(username='photographer'),
+            image=SimpleUploadedFile('photo.jpg',
+                                     jpeg((4000, 3000)).getvalue(),
+                                     content_type='image/jpeg'),
+        )
+
+    def test_meta_computed_at_upload(self):
+        """Размеры берутся у сохранённой уменьшенной картинки."""
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.image_width, post.image_height),
+                         (2560, 1920))
+        self.assertTrue(post.image_placeholder.startswith('data:image/'))
+        self.assertLess(len(post.image_placeholder), 1024)
+
+    def test_meta_cleared_with_image(self):
+        post = Post.objects.get(pk=self.post.pk)
+        post.image = None
+        post.save()
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_placeholder, '')
+
+    def test_listing_emits_size_and_placeholder(self):
+        """Лента выводит размеры и заглушку, не открывая картинку."""
+        with mock.patch.object(Image, 'open') as image_open:
+            response = self.client.get(reverse('index'))
+        image_open.assert_not_called()
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, self.post.image_placeholder)
+
+    def test_display_size(self):
+        specs = {'fit': ('200x200', {'upscale': False})}
+        with mock.patch.dict(thumbnails.THUMBNAIL_SPECS, specs):
+            self.assertEqual(thumbnails.display_size('fit', 400, 100),
+                             (200, 50))
+            self.assertEqual(thumbnails.display_size('fit', 100, 50),
+                             (100, 50))
+        self.assertEqual(thumbnails.display_size('card', 100, 50),
+                         (960, 339))
+        self.assertIsNone(thumbnails.display_size('card', None, None))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PruneThumbnailsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        author = User.objects.create_user(username='hoarder')
+        self.old, self.recent = (
+            thumbnails.get_or_create(Post.objects.create(
+                text=text, author=author,
+                image=SimpleUploadedFile(f'{text}.jpg', jpeg(size).getvalue()),
+            ).image.name, 'card')
+            for text, size in (('старый', (100, 80)), ('свежий', (80, 100)))
+        )
+        hour = 60 * 60
+        for thumb, accessed in ((self.old, time.time() - 10 * hour),
+                                (self.recent, time.time() - hour)):
+            for name in thumbnails.with_variants(thumb.name):
+                path = os.path.join(MEDIA_ROOT, name)
+                if os.path.exists(path):
+                    os.utime(path, (accessed, os.stat(path).st_mtime))
+
+    def group_size(self, thumb):
+        return sum(os.path.getsize(os.path.join(MEDIA_ROOT, name))
+                   for name in thumbnails.with_variants(thumb.name)
+                   if os.path.exists(os.path.join(MEDIA_ROOT, name)))
+
+    def test_least_recently_used_evicted(self):
+        """Вытесняются самые давние превью вместе с вариантами и записями."""
+        out = StringIO()
+        call_command('prune_thumbnails', min_idle=0, stdout=out,
+                     max_size=self.group_size(self.old)
+                     + self.group_size(self.recent) - 1)
+        for name in thumbnails.with_variants(self.old.name):
+            self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, name)))
+        self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT,
+                                                    self.recent.name)))
+        self.assertIsNone(default.kvstore.get(self.old))
+        self.assertTrue(default.kvstore.get(self.recent))
+        self.assertIn('Удалено превью: 1', out.getvalue())
+
+    def test_recently_used_kept(self):
+        """Превью, открытые за --min-idle часов, не трогаются."""
+        call_command('prune_thumbnails', min_idle=48, max_size=0,
+                     stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT,
+                                                    self.old.name)))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class OgImageTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.post = Post.objects.create(
+            text='очень длинный текст поста ' * 40,
+            author=User.objects.create_user(username='photographer'),
+            image=SimpleUploadedFile('photo.jpg',
+                                     jpeg((800, 600)).getvalue(),
+                                     content_type='image/jpeg'),
+        )
+
+    def test_built_and_stored(self):
+        name = og_images.build(self.post.pk)
+        self.assertTrue(name.startswith('og/'))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).og_image, name)
+        with Image.open(os.path.join(MEDIA_ROOT, name)) as image:
+            self.assertEqual(image.size, og_images.SIZE)
+            self.assertEqual(image.format, 'JPEG')
+        with mock.patch.object(og_images, 'render') as render:
+            self.assertEqual(og_images.build(self.post.pk), name)
+        render.assert_not_called()
+
+    def test_without_image(self):
+        post = Post.objects.create(text='только текст',
+                                   author=self.post.author)
+        name = og_images.build(post.pk)
+        with Image.open(os.path.join(MEDIA_ROOT, name)) as image:
+            self.assertEqual(image.size, og_images.SIZE)
+
+    def test_scheduled_on_create_and_edit(self):
+        """Картинка строится после коммита, а правка даёт новое имя."""
+        with mock.patch.object(og_images, 'build_on_commit') as schedule:
+            post = Post.objects.create(text='новый пост',
+                                       author=self.post.author)
+            first = og_images.build(post.pk)
+            post.refresh_from_db()
+            post.text = 'исправленный пост'
+            post.save()
+        self.assertEqual([call[0] for call in schedule.call_args_list],
+                         [(post.pk,), (post.pk,)])
+        post.refresh_from_db()
+        self.assertEqual(post.og_image, first)
+        self.assertNotEqual(og_images.build(post.pk), first)
+
+    def test_stale_build_does_not_overwrite(self):
+        """Картинка по снимку поста, поправленного во время сборки, не
+        записывается поверх новой."""
+        post = Post.objects.create(text='пост', author=self.post.author)
+        render = og_images.render
+
+        def edit_while_rendering(snapshot):
+            Post.objects.filter(pk=post.pk).update(text='правка',
+                                                   og_image='og/new.jpg')
+            return render(snapshot)
+
+        with mock.patch.object(og_images, 'render',
+                               side_effect=edit_while_rendering):
+            self.assertIsNone(og_images.build(post.pk))
+        post.refresh_from_db()
+        self.assertEqual(post.og_image, 'og/new.jpg')
+
+    def test_comment_during_build_keeps_image(self):
+        """Комментарий во время сборки (он сдвигает version) не мешает
+        записать картинку."""
+        post = Post.objects.create(text='пост с комментарием',
+                                   author=self.post.author)
+        render = og_images.render
+
+        def comment_while_rendering(snapshot):
+            Comment.objects.create(post=post, text='к',
+                                   author=self.post.author)
+            return render(snapshot)
+
+        with mock.patch.object(og_images, 'render',
+                               side_effect=comment_while_rendering):
+            name = og_images.build(post.pk)
+        post.refresh_from_db()
+        self.assertEqual(post.og_image, name)
+        self.assertTrue(name)
+
+    def test_build_follows_setting(self):
+        """Картинка отправляется в пул, только если OG_IMAGES включён в
+        момент вызова."""
+        with override_settings(OG_IMAGES=False), \
+                mock.patch.object(og_images.transaction,
+                                  'on_commit') as on_commit:
+            og_images.build_on_commit(self.post.pk)
+        on_commit.assert_not_called()
+
+    def test_post_page_references_file(self):
+        """Страница поста ссылается на готовый файл, не строя картинку."""
+        name = og_images.build(self.post.pk)
+        with mock.patch.object(og_images, 'render') as render:
+            response = self.client.get(reverse('post', kwargs={
+                'username': 'photographer', 'post_id': self.post.pk,
+            }))
+        render.assert_not_called()
+        self.assertContains(
+            response, f'<meta property="og:image" '
+                      f'content="http://testserver{settings.MEDIA_URL}{name}">'
+        )
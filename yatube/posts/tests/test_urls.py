@@ -1,8 +1,14 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
+from django.urls import (NoReverseMatch, Resolver404, get_resolver,
+                         include, path, re_path, resolve, reverse,
+                         set_script_prefix)
+from django.urls.resolvers import RoutePattern, URLResolver
 from datetime import datetime
 
-from ..models import Post, Group
+from ..models import Comment, Post, Group
+from ..url_builders import url_for
+from ..url_dispatch import SegmentTrieResolver
 
 User = get_user_model()
 
@@ -134,3 +140,151 @@ class YatubeURLTests(TestCase):
             response,
             f'/{username}/{post_id}/'
         )
+
+
+class UrlBuilderTests(TestCase):
+    """Адреса из posts/url_builders.py совпадают с reverse()."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='Вася.Пупкин+1')
+        self.group = Group.objects.create(title='группа', slug='test-slug')
+        self.post = Post.objects.create(text='текст', author=self.author,
+                                        group=self.group)
+        self.comment = Comment.objects.create(post=self.post,
+                                              author=self.author,
+                                              text='комментарий')
+
+    def assert_same_urls(self):
+        post = self.post
+        username = self.author.username
+        comment = post.comments.get()
+        self.assertEqual(post.get_absolute_url(),
+                         reverse('post', args=[username, post.id]))
+        self.assertEqual(post.author_url, reverse('profile', args=[username]))
+        self.assertEqual(post.edit_url,
+                         reverse('post_edit', args=[username, post.id]))
+        self.assertEqual(post.delete_url,
+                         reverse('post_del', args=[username, post.id]))
+        self.assertEqual(post.group_url,
+                         reverse('group_posts', args=[self.group.slug]))
+        self.assertEqual(comment.author_url,
+                         reverse('profile', args=[username]))
+        self.assertEqual(comment.delete_url, reverse(
+            'comment_del', args=[username, post.id, comment.id]
+        ))
+
+    def test_same_as_reverse(self):
+        self.assert_same_urls()
+
+    def test_script_prefix(self):
+        set_script_prefix('/sub path/')
+        try:
+            self.assert_same_urls()
+        finally:
+            set_script_prefix('/')
+
+    def test_without_group(self):
+        self.post.group = None
+        self.assertEqual(self.post.group_url, '')
+
+    def test_invalid_arguments(self):
+        """Аргументы, не подходящие маршруту, дают ту же ошибку."""
+        with self.assertRaises(NoReverseMatch):
+            url_for('post', 'user', 'not-a-number')
+        with self.assertRaises(NoReverseMatch):
+            url_for('group_posts', 'не slug')
+        self.assertEqual(url_for('index'), reverse('index'))
+
+
+def dummy_view(request, **kwargs):
+    pass
+
+
+# маршруты, которые дерево сегментов не раскладывает или раскладывает
+# иначе, чем posts/urls.py
+EDGE_PATTERNS = [
+    re_path(r'^re/(?P<year>[0-9]{4})/$', dummy_view, name='regex'),
+    path('files/<path:name>/raw/', dummy_view, name='path_middle'),
+    path('files/<path:name>', dummy_view, name='path_tail'),
+    path('page-<int:number>/', dummy_view, name='mixed'),
+    path('nested/', include([
+        path('<slug:slug>/', dummy_view, name='nested_slug'),
+    ])),
+    path('<uuid:key>/', dummy_view, name='uuid'),
+    path('<str:name>/', dummy_view, name='name'),
+]
+
+
+class SegmentTrieResolverTests(TestCase):
+    """Дерево сегментов находит те же маршруты, что и URLResolver."""
+
+    paths = [
+        '', 'new/', 'new', 'search/', 'follow/', 'follow', 'follow/follow/',
+        'follow/unfollow/', '404/', '500/', '404/1/', '404/follow/',
+        'group/', 'group/slug/', 'group/slug', 'group/не-slug/',
+        'group/slug/1/', 'group/1/', 'group/1/edit/', 'user/', 'user',
+        'user/follow/', 'user/unfollow/', 'user/1/', 'user/abc/',
+        'user/1/edit/', 'user/abc/edit/', 'user/1/post_del/',
+        'user/1/comment', 'user/1/comment/', 'user/abc/comment',
+        'user/1/comment_del/2', 'user/1/comment_del/x', 'user//',
+        '//', '/user/', 'new/1/', 'search/1/', 'thumbs/card/sig/a.jpg',
+        'thumbs/card/sig/posts/a/b/c.jpg', 'thumbs/card/sig/', 'thumbs/card/',
+        'thumbs/', 'Вася/1/', 'user/1/edit', 'user/1/2/3/',
+        'thumbs/card/sig/a\nb.jpg', 'thumbs/card/sig/\n', 'user\n/',
+        'user/1\n/', 'user/١/',
+    ]
+    edge_paths = [
+        're/2021/', 're/21/', 'files/a/b/raw/', 'files/a/b', 'files/',
+        'page-1/', 'page-x/', 'nested/slug/', 'nested/a b/', 'nested/',
+        '12345678-1234-1234-1234-123456789abc/', 'name/', 'a/b/',
+        'files/\n/raw/',
+    ]
+
+    def assert_same(self, urlconf, paths):
+        plain = URLResolver(RoutePattern(''), urlconf)
+        trie = SegmentTrieResolver(RoutePattern(''), urlconf)
+        for url in paths:
+            with self.subTest(url=url):
+                try:
+                    expected = plain.resolve(url)
+                except Resolver404 as error:
+                    with self.assertRaises(Resolver404) as raised:
+                        trie.resolve(url)
+                    self.assertEqual(raised.exception.args, error.args)
+                    continue
+                match = trie.resolve(url)
+                self.assertEqual(
+                    (match.func, match.args, match.kwargs, match.url_name,
+                     match.route, match.namespaces),
+                    (expected.func, expected.args, expected.kwargs,
+                     expected.url_name, expected.route, expected.namespaces),
+                )
+
+    def test_posts_urls(self):
+        # все маршруты posts/urls.py ложатся в дерево
+        trie = SegmentTrieResolver(RoutePattern(''), 'posts.urls')
+        self.assertEqual(trie._trie[1], [])
+        self.assert_same('posts.urls', self.paths)
+
+    def test_ambiguous_prefixes(self):
+        """Побеждает маршрут, стоящий в urlpatterns раньше."""
+        trie = SegmentTrieResolver(RoutePattern(''), 'posts.urls')
+        self.assertEqual(trie.resolve('follow/').url_name, 'follow_index')
+        # 404/ стоит после <str:username>/ и перекрыт им, как и без дерева
+        self.assertEqual(trie.resolve('404/').url_name, 'profile')
+        self.assertEqual(trie.resolve('group/').url_name, 'profile')
+        self.assertEqual(trie.resolve('group/x/').url_name, 'group_posts')
+        self.assertEqual(trie.resolve('follow/follow/').url_name,
+                         'profile_follow')
+        self.assertEqual(trie.resolve('404/1/').url_name, 'post')
+
+    def test_patterns_outside_trie(self):
+        self.assert_same(EDGE_PATTERNS, self.edge_paths)
+
+    def test_site_urlconf(self):
+        """Сайт разбирает адреса постов деревом, остальное - как было."""
+        resolver = get_resolver()
+        self.assertIsInstance(resolver.url_patterns[-1], SegmentTrieResolver)
+        self.assertEqual(resolve('/user/1/').url_name, 'post')
+        self.assertEqual(resolve('/auth/login/').url_name, 'login')
+        self.assertEqual(resolve('/about/author/').namespaces, ['about'])
@@ -1,4 +1,5 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
+from .. import page_cache
 from ..forms import PostForm
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase
@@ -7,15 +8,24 @@ from datetime import datetime
 from django import forms
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.shortcuts import get_object_or_404
 import shutil
 import tempfile
 
-from ..models import Comment, Follow, Post, Group
+from ..models import Comment, Follow, Post, Group, UserStats
 
 User = get_user_model()
 
 
+def run_on_commit():
+    """Выполняет колбэки on_commit, до которых TestCase не доходит."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
 class PostsPagesTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -135,6 +145,41 @@ class PaginatorViewsTest(TestCase):
                     len(response.context.get('page').object_list),
                     post_count)
 
+    def test_cursor_pages_do_not_shift(self):
+        """
+        Курсор ?before= отдаёт те же 3 поста второй страницы даже после
+        того, как сверху появился новый пост.
+        """
+        urls = [f'/{PaginatorViewsTest.user.username}/',
+                '/',
+                f'/group/{PaginatorViewsTest.group.slug}/']
+        for url in urls:
+            with self.subTest(url=url):
+                cache.clear()
+                first = self.client.get(url).context['page']
+                second = self.client.get(url, {'page': 2}).context['page']
+                fresh = Post.objects.create(text='Свежий пост',
+                                            group=PaginatorViewsTest.group,
+                                            author=PaginatorViewsTest.user)
+                response = self.client.get(
+                    url, {'before': first.next_cursor})
+                page = response.context['page']
+                self.assertEqual(list(page.object_list),
+                                 list(second.object_list))
+                self.assertFalse(page.has_next())
+                fresh.delete()
+
+    def test_broken_cursor_gives_first_page(self):
+        """Испорченный или слишком большой курсор - первая страница."""
+        for before in ('abc', '1_2_3', '99999999999999999999_1',
+                       '-99999999999999999999_1', f'1_{2 ** 63}',
+                       f'1_{10 ** 30}', '1_0'):
+            with self.subTest(before=before):
+                response = self.client.get('/', {'before': before})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    len(response.context['page'].object_list), 10)
+
 
 class ContextsTests(TestCase):
     @classmethod
@@ -459,3 +504,127 @@ class CommentTests(TestCase):
                     },
                     )
         )
+
+
+class QueryBudgetTests(TestCase):
+    """Число запросов страницы не зависит от числа постов на ней."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Reader')
+        cls.author = User.objects.create_user(username='Writer')
+        cls.group = Group.objects.create(title='Группа', slug='budget')
+        UserStats.for_user(cls.author)
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for i in range(12):
+            post = Post.objects.create(text=f'Пост {i}',
+                                       group=cls.group,
+                                       author=cls.author)
+            Comment.objects.create(post=post,
+                                   text=f'Коммент {i}',
+                                   author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(QueryBudgetTests.user)
+
+    def test_listing_query_budget(self):
+        """Страницы со списками постов укладываются в бюджет запросов."""
+        post = Post.objects.first()
+        budgets = {
+            reverse('index'): 5,
+            reverse('group_posts', kwargs={'slug': 'budget'}): 6,
+            reverse('profile', kwargs={'username': 'Writer'}): 6,
+            reverse('follow_index'): 6,
+            reverse('post', kwargs={'username': 'Writer',
+                                    'post_id': post.id}): 5,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.authorized_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                sql = [query['sql'] for query in queries
+                       if 'SAVEPOINT' not in query['sql']]
+                self.assertLessEqual(len(sql), budget, '\n'.join(sql))
+
+
+class CardCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='CardAuthor')
+        cls.group = Group.objects.create(title='Карточки', slug='cards')
+        cls.post = Post.objects.create(text='Текст карточки',
+                                       group=cls.group,
+                                       author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('group_posts', kwargs={'slug': 'cards'})
+        self.edit_url = reverse('post_edit', kwargs={
+            'username': 'CardAuthor', 'post_id': CardCacheTests.post.id})
+        self.author_client = Client()
+        self.author_client.force_login(CardCacheTests.author)
+
+    def test_owner_buttons_not_cached_for_others(self):
+        """Кнопки автора видит только автор, хотя карточка общая."""
+        self.assertContains(self.author_client.get(self.url), self.edit_url)
+        self.assertNotContains(self.client.get(self.url), self.edit_url)
+        self.assertContains(self.author_client.get(self.url), self.edit_url)
+
+    def test_card_invalidated_on_change(self):
+        """Правка поста и новый комментарий обновляют карточку."""
+        self.client.get(self.url)
+        post = Post.objects.get(pk=CardCacheTests.post.pk)
+        post.text = 'Новый текст карточки'
+        post.save()
+        self.assertContains(self.client.get(self.url), 'Новый текст')
+        Comment.objects.create(post=post, text='к', author=self.author)
+        self.assertContains(self.client.get(self.url), 'Комментариев: 1')
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='PageAuthor')
+        cls.post = Post.objects.create(text='Первый пост',
+                                       author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('profile', kwargs={'username': 'PageAuthor'})
+
+    def test_anonymous_page_served_from_cache(self):
+        """Повторный анонимный запрос не ходит в базу и не варьирует
+        ответ по cookie."""
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Первый пост')
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_page_cache_invalidated_on_new_post(self):
+        """Новый пост сбрасывает закэшированные страницы."""
+        self.client.get(self.url)
+        Post.objects.create(text='Второй пост', author=self.author)
+        self.assertContains(self.client.get(self.url), 'Второй пост')
+
+    def test_page_cache_invalidated_after_commit(self):
+        """После коммита поколение кэша сдвигается ещё раз: страницы,
+        собранные до коммита из старых данных, не читаются."""
+        Post.objects.create(text='Второй пост', author=self.author)
+        before_commit = page_cache.generation()
+        run_on_commit()
+        self.assertNotEqual(page_cache.generation(), before_commit)
+
+    def test_authorized_user_bypasses_cache(self):
+        """Авторизованный пользователь получает свежую страницу."""
+        self.client.get(self.url)
+        authorized_client = Client()
+        authorized_client.force_login(self.author)
+        response = authorized_client.get(self.url)
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Выйти')
@@ -0,0 +1,108 @@
+"""Движок sorl-thumbnail, который не декодирует оригинал целиком.
+
+Штатный движок PIL открывает фотографию с камеры в полном разрешении и
+только потом сжимает её до размера карточки. Этот движок:
+
+- просит у декодера JPEG сразу уменьшенную в 2, 4 или 8 раз картинку
+  (draft, масштабирование DCT), если она всё ещё не меньше превью;
+- уменьшает остаток через resize с reducing_gap: сначала быстрый
+  reduce() в целое число раз, затем LANCZOS на последнем шаге;
+- увеличивает маленькие картинки (upscale) более дешёвым BICUBIC;
+- рядом с превью сразу пишет его варианты в форматах из опции variants
+  (AVIF, WebP) из того же уменьшенного изображения: cache/ab/cd/key.jpg,
+  cache/ab/cd/key.avif, cache/ab/cd/key.webp.
+
+Подключается настройкой THUMBNAIL_ENGINE = 'posts.thumbnail_engine.Engine'.
+"""
+import math
+import mimetypes
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, features
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine
+
+# во сколько раз картинка должна быть больше превью, чтобы сначала
+# уменьшить её быстрым reduce(); 3 даёт качество, неотличимое от LANCZOS
+REDUCING_GAP = 3.0
+# настройки кодирования вариантов превью, по убыванию выгоды в размере
+VARIANT_OPTIONS = {
+    'AVIF': {'quality': 60, 'speed': 8},
+    'WEBP': {'quality': 80, 'method': 4},
+}
+MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp'}
+# старые версии mimetypes не знают этих расширений
+for _format, _type in MIME_TYPES.items():
+    mimetypes.add_type(_type, f'.{_format.lower()}')
+
+
+def supported_variants(formats):
+    """Форматы вариантов, которые умеет кодировать установленный Pillow."""
+    return tuple(image_format for image_format in formats
+                 if image_format in VARIANT_OPTIONS
+                 and features.check(image_format.lower()))
+
+
+def variant_name(name, image_format):
+    return f'{os.path.splitext(name)[0]}.{image_format.lower()}'
+
+
+class Engine(PILEngine):
+
+    def create(self, image, geometry, options):
+        self.draft(image, geometry, options)
+        return super().create(image, geometry, options)
+
+    def draft(self, image, geometry, options):
+        """Настраивает декодер JPEG на уменьшенное чтение картинки."""
+        if image.format != 'JPEG' or options.get('cropbox') \
+                or options.get('remove_border'):
+            # эти опции считают координаты по полному оригиналу
+            return
+        x_image, y_image = image.size
+        flipped = (options.get('orientation',
+                               sorl_settings.THUMBNAIL_ORIENTATION)
+                   and self._flip_dimensions(image))
+        if flipped:
+            factor = self._calculate_scaling_factor(y_image, x_image,
+                                                    geometry, options)
+        else:
+            factor = self._calculate_scaling_factor(x_image, y_image,
+                                                    geometry, options)
+        # превью повышенной плотности (@2x) строятся из той же картинки
+        factor *= max([1, *sorl_settings.THUMBNAIL_ALTERNATIVE_RESOLUTIONS])
+        if factor < 1:
+            # декодер вернёт картинку не меньше запрошенного размера
+            image.draft(image.mode, (math.ceil(x_image * factor),
+                                     math.ceil(y_image * factor)))
+
+    def write(self, image, options, thumbnail):
+        # варианты пишутся раньше основного файла: sorl запоминает превью
+        # в хранилище ключей после write, и тогда варианты уже на диске
+        for image_format in options.get('variants', ()):
+            if image_format != options['format']:
+                self.write_variant(image, image_format, thumbnail)
+        super().write(image, options, thumbnail)
+
+    def write_variant(self, image, image_format, thumbnail):
+        name = variant_name(thumbnail.name, image_format)
+        storage = thumbnail.storage
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(self.encode(image, image_format)))
+
+    @staticmethod
+    def encode(image, image_format):
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+        output = BytesIO()
+        image.save(output, image_format, **VARIANT_OPTIONS[image_format])
+        return output.getvalue()
+
+    def _scale(self, image, width, height):
+        if width > image.width or height > image.height:
+            return image.resize((width, height), resample=Image.BICUBIC)
+        return image.resize((width, height), resample=Image.LANCZOS,
+                            reducing_gap=REDUCING_GAP)
@@ -0,0 +1,395 @@
+"""Превью картинок постов, которые строятся по запросу, а не при рендере.
+
+Шаблон выводит только подписанный адрес превью (thumbnail_url), не
+открывая саму картинку. Превью строит view thumbnail при первом
+обращении через sorl: файл ложится в кэш sorl на диске, запись о нём -
+в хранилище ключей sorl. Одновременные запросы одного превью
+выстраиваются в очередь на файловой блокировке, поэтому картинку
+декодирует только первый из них, а остальные получают готовый файл.
+
+Размеры задаются именованными спецификациями THUMBNAIL_SPECS. Подпись
+покрывает и саму спецификацию, так что при смене размеров меняются
+адреса, и превью можно отдавать с долгим Cache-Control.
+
+Для srcset у спецификации есть уменьшенные копии по ширинам из
+THUMBNAIL_SRCSET_WIDTHS: 'card-320', 'card-480' и т.д. с теми же
+пропорциями и опциями. Все они строятся в фоне сразу после загрузки
+картинки (prebuild_on_commit) и командой build_thumbnails.
+"""
+import hashlib
+import os
+import tempfile
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections, transaction
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import deserialize, toint
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from sorl.thumbnail.parsers import parse_geometry
+
+from .thumbnail_engine import MIME_TYPES, supported_variants, variant_name
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+THUMBNAIL_SPECS = dict(getattr(settings, 'THUMBNAIL_SPECS', {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}))
+# ширины уменьшенных копий превью для srcset
+THUMBNAIL_SRCSET_WIDTHS = getattr(settings, 'THUMBNAIL_SRCSET_WIDTHS', {
+    'card': (320, 480, 640),
+})
+# каталог файлов блокировок, которыми процессы делят построение превью
+THUMBNAIL_LOCK_DIR = getattr(
+    settings, 'THUMBNAIL_LOCK_DIR',
+    os.path.join(tempfile.gettempdir(), 'yatube-thumbnail-locks')
+)
+# варианты превью в более компактных форматах, по убыванию предпочтения;
+# форматы, которые не умеет установленный Pillow, пропускаются
+THUMBNAIL_VARIANTS = supported_variants(
+    getattr(settings, 'THUMBNAIL_VARIANT_FORMATS', ('AVIF', 'WEBP'))
+)
+# блокировок конечное число: разные превью изредка делят одну
+LOCK_STRIPES = 256
+# ключей в одном запросе к таблице sorl, в пределах лимита SQLite
+KEYS_PER_QUERY = 500
+SALT = 'posts.thumbnails'
+
+logger = logging.getLogger(__name__)
+_thread_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+_prebuild_pool = None
+
+
+def _srcset_specs():
+    """{спецификация: [(ширина, спецификация копии), ...]} по возрастанию
+    ширины; сама спецификация идёт последней."""
+    srcset = {}
+    for spec, widths in THUMBNAIL_SRCSET_WIDTHS.items():
+        geometry, options = THUMBNAIL_SPECS[spec]
+        x_geometry, y_geometry = parse_geometry(geometry)
+        srcset[spec] = []
+        for width in sorted(widths):
+            if width >= x_geometry:
+                continue
+            name = f'{spec}-{width}'
+            height = toint(y_geometry * width / x_geometry)
+            THUMBNAIL_SPECS[name] = (f'{width}x{height}', options)
+            srcset[spec].append((width, name))
+        srcset[spec].append((x_geometry, spec))
+    return srcset
+
+
+SRCSET_SPECS = _srcset_specs()
+
+
+def _signed_value(spec, name):
+    geometry, options = THUMBNAIL_SPECS[spec]
+    return f'{spec}:{geometry}:{sorted(options.items())}:{name}'
+
+
+def signature(spec, name):
+    return signing.Signer(salt=SALT).signature(_signed_value(spec, name))
+
+
+def check_signature(spec, name, value):
+    return (spec in THUMBNAIL_SPECS
+            and constant_time_compare(value, signature(spec, name)))
+
+
+def thumbnail_url(image, spec):
+    """Адрес превью картинки; сама картинка при этом не читается."""
+    return reverse('thumbnail', kwargs={'spec': spec,
+                                        'signature': signature(spec,
+                                                               image.name),
+                                        'name': image.name})
+
+
+def display_size(spec, width, height):
+    """Размер превью по размеру картинки, как его посчитает sorl.
+
+    Нужен для width/height у <img>; сама картинка не читается.
+    """
+    if not width or not height:
+        return None
+    geometry, options = THUMBNAIL_SPECS[spec]
+    x_geometry, y_geometry = parse_geometry(geometry, width / height)
+    factors = (x_geometry / width, y_geometry / height)
+    crop = options.get('crop')
+    factor = max(factors) if crop else min(factors)
+    if not options.get('upscale', sorl_settings.THUMBNAIL_UPSCALE):
+        factor = min(factor, 1)
+    x_size, y_size = toint(width * factor), toint(height * factor)
+    if crop:
+        return min(x_size, x_geometry), min(y_size, y_geometry)
+    return x_size, y_size
+
+
+@contextmanager
+def coalesce(key):
+    """Пока превью строит один запрос, остальные с тем же ключом ждут."""
+    stripe = int(hashlib.md5(key.encode()).hexdigest(), 16) % LOCK_STRIPES
+    if fcntl is None:
+        with _thread_locks[stripe]:
+            yield
+        return
+    os.makedirs(THUMBNAIL_LOCK_DIR, exist_ok=True)
+    path = os.path.join(THUMBNAIL_LOCK_DIR, f'{stripe}.lock')
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def sorl_options(spec):
+    """Геометрия и опции sorl для спецификации, вместе с вариантами.
+
+    Список вариантов входит в ключ превью sorl, поэтому превью,
+    построенные без вариантов, не используются и строятся заново.
+    """
+    geometry, options = THUMBNAIL_SPECS[spec]
+    return geometry, dict(options, variants=THUMBNAIL_VARIANTS)
+
+
+def thumbnail_file(name, spec):
+    """Превью под тем именем, которое даст ему sorl; диск не читается."""
+    geometry, options = sorl_options(spec)
+    backend = default.backend
+    source = ImageFile(name)
+    # опции дополняются так же, как в ThumbnailBackend.get_thumbnail
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, geometry, options),
+        default.storage,
+    )
+
+
+def built(name, spec):
+    """Готовое превью из хранилища ключей sorl или None."""
+    return default.kvstore.get(thumbnail_file(name, spec))
+
+
+def built_many(names, spec):
+    """Готовые превью для нескольких картинок: {имя: ImageFile}."""
+    return {name: thumb
+            for (name, _), thumb in built_for(names, [spec]).items()}
+
+
+def built_for(names, specs):
+    """Готовые превью картинок по спецификациям: {(имя, спец.): ImageFile}.
+
+    Для хранилища ключей sorl по умолчанию (кэш + таблица) это один
+    get_many к кэшу и не больше одного запроса к таблице на промахи,
+    вместо отдельного обращения на каждое превью.
+    """
+    wanted = {(name, spec) for name in names for spec in specs}
+    if not wanted:
+        return {}
+    if not isinstance(default.kvstore, cached_db_kvstore.KVStore):
+        found = {pair: built(*pair) for pair in wanted}
+        return {pair: thumb for pair, thumb in found.items() if thumb}
+    keys = {add_prefix(thumbnail_file(*pair).key): pair for pair in wanted}
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(key__in=missing)
+                      .values_list('key', 'value'))
+        # как и sorl, кэшируем и отсутствие записи
+        fetched = {key: stored.get(key, cached_db_kvstore.EMPTY_VALUE)
+                   for key in missing}
+        kv_cache.set_many(fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    return {keys[key]: deserialize_image_file(value)
+            for key, value in values.items()
+            if value and value != cached_db_kvstore.EMPTY_VALUE}
+
+
+def _get_raw_many(keys):
+    """Сырые значения хранилища ключей sorl: {ключ: значение}."""
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        values = {key: kvstore._get_raw(key) for key in keys}
+        return {key: value for key, value in values.items() if value}
+    found = {}
+    for start in range(0, len(keys), KEYS_PER_QUERY):
+        found.update(KVStoreModel.objects.filter(
+            key__in=keys[start:start + KEYS_PER_QUERY]
+        ).values_list('key', 'value'))
+    return found
+
+
+def _delete_raw_many(keys):
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        if keys:
+            kvstore._delete_raw(*keys)
+        return
+    for start in range(0, len(keys), KEYS_PER_QUERY):
+        chunk = keys[start:start + KEYS_PER_QUERY]
+        KVStoreModel.objects.filter(key__in=chunk).delete()
+        kvstore.cache.delete_many(chunk)
+
+
+def with_variants(name):
+    """Имя превью и имена всех его возможных вариантов."""
+    return [name, *(variant_name(name, image_format)
+                    for image_format in MIME_TYPES)]
+
+
+def forget(names):
+    """Удаляет из хранилища ключей sorl записи картинок names и всех их
+    превью пакетом запросов. Возвращает имена файлов этих превью вместе
+    с вариантами; сами файлы не удаляются."""
+    source_keys = [ImageFile(name).key for name in names]
+    lists = _get_raw_many([add_prefix(key, 'thumbnails')
+                           for key in source_keys])
+    thumb_keys = [add_prefix(key) for value in lists.values()
+                  for key in deserialize(value)]
+    files = [file_name
+             for value in _get_raw_many(thumb_keys).values()
+             for file_name in with_variants(deserialize_image_file(value)
+                                            .name)]
+    _delete_raw_many([add_prefix(key) for key in source_keys]
+                     + list(lists) + thumb_keys)
+    return files
+
+
+def forget_thumbnails(names):
+    """Удаляет записи sorl о файлах превью names. Ключ превью в sorl
+    считается по его имени, поэтому источник знать не нужно; ключ,
+    оставшийся в списке превью источника, sorl пропускает."""
+    _delete_raw_many([add_prefix(ImageFile(name).key) for name in names])
+
+
+def stored_names():
+    """Имена всех картинок и превью из хранилища ключей sorl."""
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        for key in kvstore._find_keys(identity='image'):
+            image = kvstore._get(key)
+            if image:
+                yield image.name
+        return
+    values = (KVStoreModel.objects.filter(key__startswith=add_prefix(''))
+              .values_list('value', flat=True))
+    for value in values.iterator():
+        yield deserialize_image_file(value).name
+
+
+def sources(thumbs):
+    """Варианты превью для <source> в <picture>: тип и srcset.
+
+    thumbs - список (ширина, превью) по возрастанию ширины.
+    """
+    result = []
+    for image_format in THUMBNAIL_VARIANTS:
+        candidates = [
+            f'{thumb.storage.url(variant_name(thumb.name, image_format))}'
+            f' {width}w' for width, thumb in thumbs
+        ]
+        result.append({'type': MIME_TYPES[image_format],
+                       'srcset': ', '.join(candidates)})
+    return result
+
+
+def srcset(image, spec, found=None):
+    """srcset превью картинки: готовые копии ссылаются на файлы, для
+    остальных подписанные адреса, по которым их построит view."""
+    found = found or {}
+    candidates = []
+    for width, width_spec in SRCSET_SPECS.get(spec, [(None, spec)]):
+        thumb = found.get((image.name, width_spec))
+        url = thumb.url if thumb else thumbnail_url(image, width_spec)
+        candidates.append(f'{url} {width}w' if width else url)
+    return ', '.join(candidates)
+
+
+def negotiate(thumb, accept):
+    """Имя лучшего варианта превью для заголовка Accept."""
+    for image_format in THUMBNAIL_VARIANTS:
+        if MIME_TYPES[image_format] in accept:
+            name = variant_name(thumb.name, image_format)
+            if thumb.storage.exists(name):
+                return name
+    return thumb.name
+
+
+def preload(posts, spec):
+    """Кладёт в post.thumbnail готовое превью картинки поста или None,
+    в post.thumbnail_srcset - srcset копий по ширинам, а в
+    post.thumbnail_sources - их варианты для <picture>, если построены
+    все копии."""
+    specs = [width_spec for _, width_spec in
+             SRCSET_SPECS.get(spec, [(None, spec)])]
+    found = built_for([post.image.name for post in posts if post.image],
+                      specs)
+    for post in posts:
+        post.thumbnail = None
+        post.thumbnail_srcset = ''
+        post.thumbnail_sources = []
+        if not post.image:
+            continue
+        name = post.image.name
+        post.thumbnail = found.get((name, spec))
+        post.thumbnail_srcset = srcset(post.image, spec, found)
+        thumbs = [(width, found.get((name, width_spec)))
+                  for width, width_spec in SRCSET_SPECS.get(spec, [])]
+        if thumbs and all(thumb for _, thumb in thumbs):
+            post.thumbnail_sources = sources(thumbs)
+
+
+def get_or_create(name, spec):
+    """Превью из кэша sorl; при промахе строится под блокировкой."""
+    thumb = built(name, spec)
+    if thumb:
+        return thumb
+    geometry, options = sorl_options(spec)
+    with coalesce(f'{spec}:{name}'):
+        return get_thumbnail(name, geometry, **options)
+
+
+def prebuild(name):
+    """Строит все превью картинки; вызывается в фоновом потоке."""
+    try:
+        for spec in THUMBNAIL_SPECS:
+            get_or_create(name, spec)
+    except Exception:
+        # превью всё равно построит view при первом запросе
+        logger.exception('Не удалось построить превью %s', name)
+    finally:
+        connections.close_all()
+
+
+def prebuild_on_commit(name):
+    """После коммита строит превью новой картинки в фоне, чтобы первый
+    зритель не ждал их построения."""
+    global _prebuild_pool
+    # читается при вызове, чтобы тесты могли включить её override_settings
+    if not getattr(settings, 'THUMBNAIL_PREBUILD', True):
+        return
+    if _prebuild_pool is None:
+        _prebuild_pool = ThreadPoolExecutor(1)
+    transaction.on_commit(lambda: _prebuild_pool.submit(prebuild, name))
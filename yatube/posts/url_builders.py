@@ -0,0 +1,75 @@
+"""Сборка адресов без прохода по резолверу на каждую ссылку.
+
+reverse() на каждый вызов ищет имя в reverse_dict, перебирает варианты
+шаблона, подставляет аргументы и заново ищет регулярное выражение в
+кэше re. Ссылки карточек и комментариев строятся десятками на страницу,
+поэтому для имени один раз берётся его единственный вариант, а потом
+остаются подстановка в строку, проверка уже скомпилированным выражением
+и quote, как в reverse(); адрес из одних безопасных символов, обычный
+для латинских имён, не кодируется вовсе. Имена с несколькими
+вариантами, значениями по умолчанию или пространством имён, а также
+аргументы, не прошедшие проверку, отдаются обычному reverse().
+"""
+import re
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.urls import get_resolver, get_script_prefix, get_urlconf, reverse
+from django.utils.http import RFC3986_SUBDELIMS, escape_leading_slashes
+
+SAFE = RFC3986_SUBDELIMS + '/~:@'
+# символы, которые quote(safe=SAFE) оставляет как есть
+UNQUOTED = re.compile(r'[A-Za-z0-9_.\-~%s]*\Z' % re.escape(SAFE))
+PARAM = re.compile(r'%\((\w+)\)s')
+
+
+class UrlBuilder:
+    """Адрес по имени маршрута и позиционным аргументам."""
+
+    def __init__(self, name, resolver):
+        self.name = name
+        self.urlconf = resolver.urlconf_name
+        self.compiled = False
+        if ':' in name:
+            return
+        possibilities = resolver.reverse_dict.getlist(name)
+        if len(possibilities) != 1:
+            return
+        possibility, pattern, defaults, converters = possibilities[0]
+        if len(possibility) != 1 or defaults:
+            return
+        template, self.params = possibility[0]
+        # позиционная подстановка быстрее, чем по словарю имён
+        if PARAM.findall(template) != self.params:
+            return
+        self.template = PARAM.sub('%s', template)
+        self.converters = [converters[param].to_url if param in converters
+                           else str for param in self.params]
+        self.pattern = re.compile(pattern)
+        self.compiled = True
+
+    def __call__(self, *args):
+        if not self.compiled or len(args) != len(self.params):
+            return reverse(self.name, self.urlconf, args=args)
+        path = self.template % tuple(
+            to_url(value) for to_url, value in zip(self.converters, args)
+        )
+        if not self.pattern.match(path):
+            # reverse() поднимет NoReverseMatch с понятным текстом
+            return reverse(self.name, self.urlconf, args=args)
+        url = get_script_prefix() + path
+        if not UNQUOTED.match(url):
+            url = quote(url, safe=SAFE)
+        return escape_leading_slashes(url)
+
+
+@lru_cache(maxsize=None)
+def compile_builder(resolver, name):
+    # резолвер сам кэшируется по urlconf, поэтому смена ROOT_URLCONF
+    # (clear_url_caches) даёт новый ключ
+    return UrlBuilder(name, resolver)
+
+
+def url_for(name, *args):
+    """То же, что reverse(name, args=args), без прохода по резолверу."""
+    return compile_builder(get_resolver(get_urlconf()), name)(*args)
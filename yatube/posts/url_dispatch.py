@@ -0,0 +1,258 @@
+"""Разбор адресов posts/urls.py деревом сегментов.
+
+URLResolver проверяет маршруты по очереди, регулярное выражение за
+регулярным выражением, и адрес поста <str:username>/<int:post_id>/
+доходит до совпадения только после дюжины промахов. SegmentTrieResolver
+один раз раскладывает маршруты по сегментам пути в дерево: точные
+сегменты - ключи словаря, конвертеры str/int/slug/uuid - проверка
+сегмента их выражением, <path:...> в конце - остаток пути. Адрес
+проходит по дереву, и проверяются только маршруты, которые могут с ним
+совпасть, в исходном порядке и штатным pattern.resolve(). Поэтому при
+неоднозначных адресах (follow/, 404/, group/... совпадают и с
+<str:username>/...) выигрывает тот же маршрут, что и без дерева.
+
+Если хоть один маршрут в дерево не ложится (регулярное выражение,
+вложенный include, конвертер внутри сегмента или свой конвертер), адреса
+разбирает обычный URLResolver.resolve. Resolver404 и список tried на
+отладочной странице те же, что и без дерева.
+"""
+import re
+
+from django.urls import Resolver404
+from django.urls.converters import (IntConverter, PathConverter,
+                                    SlugConverter, StringConverter,
+                                    UUIDConverter)
+from django.urls.resolvers import (ResolverMatch, RoutePattern, URLPattern,
+                                   URLResolver)
+from django.utils.functional import cached_property
+
+PARAMETER = re.compile(r'<(?:(?P<converter>[^>:]+):)?(?P<parameter>\w+)>\Z')
+# конвертеры, выражение которых не выходит за пределы сегмента; их
+# подклассы могут его поменять и проверяются для любого адреса
+SEGMENT_CONVERTERS = (IntConverter, SlugConverter, StringConverter,
+                      UUIDConverter)
+
+
+class Leaf:
+    """Маршрут в дереве и имена его параметров по порядку сегментов."""
+    __slots__ = ('index', 'url_pattern', 'params', 'route')
+
+    def __init__(self, index, url_pattern, params):
+        self.index = index
+        self.url_pattern = url_pattern
+        # (имя, конвертер) параметров, последним может быть <path:...>
+        self.params = params
+        self.route = str(url_pattern.pattern)
+
+
+class Node:
+    """Узел дерева: продолжения по точному сегменту и по выражению
+    конвертера, маршруты, которые здесь заканчиваются или забирают
+    остаток пути, и наименьший индекс маршрута в поддереве."""
+    __slots__ = ('literals', 'params', 'tails', 'ends', 'first')
+
+    def __init__(self):
+        self.literals = {}
+        self.params = {}
+        self.tails = []
+        self.ends = []
+        self.first = None
+
+    def finish(self):
+        """Считает first и упорядочивает продолжения по нему."""
+        for child in self.literals.values():
+            child.finish()
+        for child in self.params.values():
+            child.finish()
+        self.params = sorted(self.params.items(),
+                             key=lambda item: item[1].first)
+        self.first = min(
+            [leaf.index for leaf in self.ends + self.tails]
+            + [child.first for child in self.literals.values()]
+            + [child.first for _, child in self.params]
+        )
+
+
+def route_segments(url_pattern):
+    """Сегменты маршрута: (точная строка, None, None),
+    (None, имя, конвертер) или (None, имя, None) для <path:...> в конце;
+    None - маршрут не раскладывается."""
+    pattern = getattr(url_pattern, 'pattern', None)
+    if not isinstance(url_pattern, URLPattern) \
+            or not isinstance(pattern, RoutePattern) \
+            or not isinstance(pattern._route, str):
+        return None
+    parts = pattern._route.split('/')
+    segments = []
+    for position, part in enumerate(parts):
+        if '<' not in part:
+            segments.append((part, None, None))
+            continue
+        match = PARAMETER.match(part)
+        if not match:
+            return None
+        name = match.group('parameter')
+        converter = pattern.converters[name]
+        if type(converter) is PathConverter:
+            if position != len(parts) - 1:
+                return None
+            segments.append((None, name, None))
+        elif type(converter) in SEGMENT_CONVERTERS:
+            segments.append((None, name, converter))
+        else:
+            return None
+    return segments
+
+
+class SegmentTrieResolver(URLResolver):
+    """URLResolver, который находит маршрут по дереву сегментов."""
+
+    @cached_property
+    def _trie(self):
+        root = Node()
+        always = []
+        compiled = {}
+        for index, url_pattern in enumerate(self.url_patterns):
+            segments = route_segments(url_pattern)
+            if segments is None:
+                always.append(index)
+                continue
+            node = root
+            params = []
+            for literal, name, converter in segments:
+                if literal is not None:
+                    node = node.literals.setdefault(literal, Node())
+                elif converter is not None:
+                    if converter.regex not in compiled:
+                        compiled[converter.regex] = re.compile(
+                            converter.regex
+                        ).fullmatch
+                    node = node.params.setdefault(
+                        compiled[converter.regex], Node()
+                    )
+                    params.append((name, converter))
+                else:
+                    params.append((name, PathConverter()))
+                    node.tails.append(Leaf(index, url_pattern, params))
+                    break
+            else:
+                node.ends.append(Leaf(index, url_pattern, params))
+        if root.literals or root.params or root.ends or root.tails:
+            root.finish()
+        return root, always
+
+    def match_leaf(self, leaf, values):
+        """kwargs маршрута или None, если конвертер отверг значение."""
+        url_pattern = leaf.url_pattern
+        try:
+            kwargs = {name: converter.to_python(value)
+                      for (name, converter), value
+                      in zip(leaf.params, values)}
+        except ValueError:
+            # как в RoutePattern.match
+            return None
+        kwargs.update(url_pattern.default_args)
+        return kwargs
+
+    def first_match(self, leaves, values, limit):
+        """(маршрут, kwargs) первого из leaves с индексом меньше limit,
+        принявшего values, или None."""
+        for leaf in leaves:
+            if leaf.index >= limit:
+                break
+            kwargs = self.match_leaf(leaf, values)
+            if kwargs is not None:
+                return leaf, kwargs
+        return None
+
+    def match_tail(self, node, path, position, values, limit):
+        """Совпадение маршрутов узла, забирающих остаток пути <path:...>."""
+        if not node.tails:
+            return None
+        rest = path.split('/', position)[-1]
+        # выражение <path:...> - .+ до конца адреса
+        if not rest or '\n' in rest:
+            return None
+        return self.first_match(node.tails, values + (rest,), limit)
+
+    def search(self, path):
+        """(маршрут, kwargs) первого по порядку в urlpatterns маршрута
+        дерева, совпавшего с path, или None.
+
+        Обход в глубину идёт сначала в поддеревья с меньшим индексом
+        маршрута и не заходит туда, где все маршруты стоят после уже
+        найденного."""
+        root, _ = self._trie
+        if root.first is None:
+            return None
+        segments = path.split('/')
+        count = len(segments)
+        best = None
+        limit = len(self.url_patterns)
+        stack = [(root, 0, ())]
+        while stack:
+            node, position, values = stack.pop()
+            if node.first >= limit:
+                continue
+            if position == count:
+                found = self.first_match(node.ends, values, limit)
+            else:
+                found = self.match_tail(node, path, position, values, limit)
+            if found is not None:
+                best, limit = found, found[0].index
+            if position < count:
+                self.push_children(stack, node, segments[position],
+                                   position + 1, values, limit)
+        return best
+
+    def push_children(self, stack, node, segment, position, values, limit):
+        """Кладёт в стек продолжения узла по сегменту в обратном порядке:
+        первым снимется поддерево с меньшим first."""
+        for fullmatch, child in reversed(node.params):
+            if child.first < limit and fullmatch(segment):
+                stack.append((child, position, values + (segment,)))
+        child = node.literals.get(segment)
+        if child is not None and child.first < limit:
+            stack.append((child, position, values))
+
+    def resolve(self, path):
+        path = str(path)
+        match = self.pattern.match(path)
+        _, always = self._trie
+        if not match or always or args_or_kwargs(match):
+            # проверка по порядку нужна для всех маршрутов вне дерева
+            return super().resolve(path)
+        new_path = match[0]
+        found = self.search(new_path)
+        if found is None:
+            # все маршруты - URLPattern без совпадения, и штатный проход
+            # собрал бы в tried каждый из них
+            raise Resolver404({
+                'tried': [[url_pattern] for url_pattern in self.url_patterns],
+                'path': new_path,
+            })
+        leaf, kwargs = found
+        # дальше - как в URLResolver.resolve
+        return ResolverMatch(
+            leaf.url_pattern.callback,
+            (),
+            {**self.default_kwargs, **kwargs},
+            leaf.url_pattern.pattern.name,
+            [self.app_name],
+            [self.namespace],
+            self._join_route('', leaf.route),
+        )
+
+
+def args_or_kwargs(match):
+    """Захватил ли что-то сам префикс include()."""
+    return bool(match[1] or match[2])
+
+
+def compiled_path(route, view, kwargs=None, name=None):
+    """path(route, include(...)) с разбором вложенного URLconf деревом."""
+    urlconf_module, app_name, namespace = view
+    return SegmentTrieResolver(
+        RoutePattern(route, name, is_endpoint=False), urlconf_module, kwargs,
+        app_name=app_name, namespace=namespace,
+    )
@@ -4,6 +4,12 @@ from . import views
 
 urlpatterns = [
     path('new/', views.new_post, name='new_post'),
+    # Поиск по записям
+    path('search/', views.search, name='search'),
+    # Превью картинок, строятся при первом запросе
+    path('thumbs/<str:spec>/<str:signature>/<path:name>',
+         views.thumbnail,
+         name='thumbnail'),
     # Работа с подписками
     path("follow/", views.follow_index, name="follow_index"),
     path("<str:username>/follow/",
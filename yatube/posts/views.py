@@ -1,8 +1,16 @@
-from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.http import Http404
 from django.shortcuts import redirect, render, get_object_or_404
+from yatube import media
 
-from .models import Group, Post, Follow, Comment
+from . import thumbnails
+from .feed import feed_for
+from .models import (DUPLICATE_TEXT_ERROR, Group, Post, Follow, Comment,
+                     UserStats)
 from .forms import PostForm, CommentForm
+from .page_cache import cache_anonymous
+from .paginators import paginate
+from . import search as post_search
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
@@ -10,13 +18,19 @@ from django.contrib.auth.decorators import login_required
 
 User = get_user_model()
 PAGIN_SET = 10
+# адрес превью меняется вместе с его спецификацией, его можно кэшировать
+THUMBNAIL_MAX_AGE = 60 * 60 * 24 * 365
 
 
+def listing(post_list):
+    """Автор и группа поста приходят тем же запросом, что и сам пост."""
+    return post_list.select_related('author', 'group')
+
+
+@cache_anonymous
 def index(request):
-    post_list = Post.objects.all().order_by('-pub_date')
-    paginator = Paginator(post_list, PAGIN_SET)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.all()
+    page = paginate(request, listing(post_list), PAGIN_SET)
     is_index = True
     return render(request,
                   'index.html',
@@ -26,12 +40,11 @@ def index(request):
                    })
 
 
+@cache_anonymous
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     posts = group.posts.all()
-    paginator = Paginator(posts, PAGIN_SET)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    page = paginate(request, listing(posts), PAGIN_SET)
     return render(request, "group.html",
                   {'group': group,
                    'page': page,
@@ -39,13 +52,14 @@ def group_posts(request, slug):
                    })
 
 
+@cache_anonymous
 def profile(request, username):
     author = get_object_or_404(User, username=username)
+    stats = UserStats.for_user(author)
     posts_of_author = author.posts.all()
-    posts_count = posts_of_author.count()
-    paginator = Paginator(posts_of_author, PAGIN_SET)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts_count = stats.posts_count
+    page = paginate(request, listing(posts_of_author), PAGIN_SET,
+                    count=posts_count)
     username = author.username
     if request.user.is_authenticated:
         following = Follow.objects.filter(
@@ -60,17 +74,19 @@ def profile(request, username):
                    'page': page,
                    'posts_of_author': posts_of_author,
                    'author': author,
+                   'stats': stats,
                    'following': following
                    })
 
 
+@cache_anonymous
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post,
+    post = get_object_or_404(listing(Post.objects),
                              author__username=username,
                              id=post_id,
                              )
     from_post_view = True
-    comments = post.comments.all()
+    comments = post.comments.select_related('author')
     form = CommentForm()
     username = post.author.username
     return render(request, 'posts/post.html',
@@ -78,12 +94,50 @@ def post_view(request, username, post_id):
                    'post_id': post_id,
                    'username': username,
                    'author': post.author,
+                   'stats': UserStats.for_user(post.author),
                    'comments': comments,
                    'form': form,
                    'from_post_view': from_post_view
                    })
 
 
+@cache_anonymous
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page = post_search.search(listing(Post.objects), query, PAGIN_SET,
+                              after=request.GET.get('after'))
+    return render(request, 'posts/search.html',
+                  {'query': query,
+                   'page': page
+                   })
+
+
+@transaction.non_atomic_requests
+def thumbnail(request, spec, signature, name):
+    if not thumbnails.check_signature(spec, name, signature):
+        raise Http404
+    thumb = thumbnails.get_or_create(name, spec)
+    # AVIF или WebP, если браузер их принимает
+    variant = thumbnails.negotiate(thumb, request.META.get('HTTP_ACCEPT', ''))
+    # 304 по ETag, Range и X-Accel-Redirect - как у остальных медиа
+    response = media.serve_file(request, variant, THUMBNAIL_MAX_AGE)
+    response['Vary'] = 'Accept'
+    return response
+
+
+def save_unique(form, post):
+    """Сохраняет пост; если такой же текст успели сохранить параллельно,
+    показывает ошибку формы вместо 500."""
+    try:
+        # точка сохранения: после ошибки транзакция запроса продолжается
+        with transaction.atomic():
+            post.save()
+    except IntegrityError:
+        form.add_error('text', DUPLICATE_TEXT_ERROR)
+        return False
+    return True
+
+
 @login_required
 def new_post(request):
     current_user = request.user
@@ -93,8 +147,8 @@ def new_post(request):
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
-            post.save()
-            return redirect('index')
+            if save_unique(form, post):
+                return redirect('index')
     return render(request, 'posts/new_post.html',
                   {'form': form,
                    'current_user': current_user,
@@ -114,8 +168,7 @@ def post_edit(request, username, post_id):
     form = PostForm(request.POST or None,
                     instance=edited_post,
                     files=request.FILES or None)
-    if form.is_valid():
-        form.save()
+    if form.is_valid() and save_unique(form, form.instance):
         return redirect('post', username, post_id)
     return render(
         request,
@@ -155,10 +208,8 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, PAGIN_SET)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = feed_for(request.user)
+    page = paginate(request, listing(post_list), PAGIN_SET)
     return render(request, 'follow.html', {'page': page})
 
 
@@ -0,0 +1,212 @@
+"""Отдача медиафайлов без фронт-сервера и вместе с ним.
+
+django.views.static.serve читает файл в Python целиком и годится только
+для DEBUG. Здесь медиа отдаются так:
+
+- ETag и Last-Modified считаются по os.stat, и условный запрос получает
+  304 без открытия файла;
+- поддерживается один диапазон Range (и If-Range), для видео и
+  докачки;
+- с настройкой MEDIA_SENDFILE_HEADER передача файла отдаётся
+  фронт-серверу: 'X-Accel-Redirect' для nginx (внутренний location с
+  префиксом MEDIA_ACCEL_PREFIX) или 'X-Sendfile' для Apache/lighttpd;
+- без фронт-сервера отдаётся FileResponse: сервер WSGI с
+  wsgi.file_wrapper (gunicorn, uWSGI) шлёт его через sendfile без
+  копирования в Python, в том числе и диапазон.
+
+MediaMiddleware отвечает на запросы к MEDIA_URL до сессий,
+аутентификации и транзакции запроса.
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/media/;
+    }
+"""
+import mimetypes
+import os
+import re
+import stat
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotAllowed)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+MEDIA_CACHE_MAX_AGE = getattr(settings, 'MEDIA_CACHE_MAX_AGE',
+                              60 * 60 * 24 * 365)
+# None, 'X-Accel-Redirect' или 'X-Sendfile'
+MEDIA_SENDFILE_HEADER = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+MEDIA_ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX',
+                             '/protected-media/')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# ответы, которые относятся к самому файлу и кэшируются надолго
+CACHEABLE_STATUSES = (200, 206, 304)
+# как часто обновлять время доступа к файлу, см. touch
+ATIME_RESOLUTION = 60 * 60 * 24
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+class FileRange:
+    """Участок файла: read() не выходит за его конец, а fileno() даёт
+    серверу WSGI отправить его через sendfile с текущей позиции."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def etag_for(file_stat):
+    return f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+
+
+def requested_range(request, size, etag, last_modified):
+    """(начало, длина) из заголовка Range или None - отдать файл целиком.
+
+    Несколько диапазонов и неверный синтаксис игнорируются, как
+    разрешает RFC 7233; диапазон за концом файла - UnsatisfiableRange.
+    """
+    match = RANGE.match(request.META.get('HTTP_RANGE', ''))
+    if not match:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag \
+            and parse_http_date_safe(if_range) != last_modified:
+        # файл изменился с прошлой докачки
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = min(int(last), size)
+        if not length:
+            raise UnsatisfiableRange
+        return size - length, length
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise UnsatisfiableRange
+    if last < first:
+        return None
+    return first, last - first + 1
+
+
+def file_response(request, path, name, file_stat, etag):
+    content_type = (mimetypes.guess_type(path)[0]
+                    or 'application/octet-stream')
+    if MEDIA_SENDFILE_HEADER:
+        # Range и If-Range фронт-сервер обработает сам
+        response = HttpResponse(content_type=content_type)
+        if MEDIA_SENDFILE_HEADER == 'X-Accel-Redirect':
+            response[MEDIA_SENDFILE_HEADER] = quote(
+                MEDIA_ACCEL_PREFIX + name.replace(os.sep, '/'))
+        else:
+            response[MEDIA_SENDFILE_HEADER] = path
+        return response
+    size = file_stat.st_size
+    try:
+        byte_range = requested_range(request, size, etag,
+                                     int(file_stat.st_mtime))
+    except UnsatisfiableRange:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    try:
+        file = open(path, 'rb')
+    except OSError:
+        raise Http404
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, length = byte_range
+        response = FileResponse(FileRange(file, start, length),
+                                status=206, content_type=content_type)
+        response['Content-Length'] = length
+        response['Content-Range'] = (f'bytes {start}-{start + length - 1}'
+                                     f'/{size}')
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def touch(path, file_stat):
+    """Раз в ATIME_RESOLUTION отмечает доступ к файлу в atime, даже при
+    монтировании с noatime: по нему prune_thumbnails вытесняет давно не
+    нужные превью. mtime, а с ним и ETag, не меняется."""
+    now = time.time_ns()
+    if now - file_stat.st_atime_ns < ATIME_RESOLUTION * 10 ** 9:
+        return
+    try:
+        os.utime(path, ns=(now, file_stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def serve_file(request, name, max_age=MEDIA_CACHE_MAX_AGE):
+    """Ответ с файлом name из MEDIA_ROOT, 304 или 206."""
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        file_stat = os.stat(path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404
+    touch(path, file_stat)
+    etag = etag_for(file_stat)
+    last_modified = int(file_stat.st_mtime)
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        response = file_response(request, path, name, file_stat, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if response.status_code in CACHEABLE_STATUSES:
+        # имена загруженных картинок и превью не переиспользуются; 416
+        # или 412 относятся к запросу, а не к файлу, и на год не кэшируются
+        response['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    return response
+
+
+def serve(request, path):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    return serve_file(request, path)
+
+
+class MediaMiddleware:
+    """Отдаёт MEDIA_URL раньше остальных middleware и URLconf."""
+
+    def __init__(self, get_response):
+        if not settings.MEDIA_URL.startswith('/'):
+            # медиа лежат на другом домене или CDN
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.MEDIA_URL
+
+    def __call__(self, request):
+        if request.path_info.startswith(self.prefix):
+            try:
+                return serve(request, request.path_info[len(self.prefix):])
+            except Http404:
+                pass
+        return self.get_response(request)
@@ -1,8 +1,15 @@
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# запуск тестов: manage.py test или pytest
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
@@ -37,6 +44,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # отдаёт MEDIA_URL до сессий и аутентификации, см. yatube/media.py
+    'yatube.media.MediaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -75,6 +84,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # запись и пересчёт счётчиков в сигналах - одна транзакция
+        'ATOMIC_REQUESTS': True,
     }
 }
 
@@ -134,8 +145,69 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
+# общий для всех воркеров кэш в файле SQLite, см. yatube/sqlite_cache.py;
+# на сервере файл лучше вынести в tmpfs через CACHE_LOCATION=/dev/shm/...
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+        'LOCATION': os.environ.get(
+            'CACHE_LOCATION', os.path.join(BASE_DIR, 'cache.sqlite3')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
     }
 }
+if TESTING:
+    # тесты очищают кэш: у каждого прогона свой временный файл, а общий
+    # cache.sqlite3 разработки и соседние прогоны не затрагиваются
+    CACHE_DIR = tempfile.mkdtemp(prefix='yatube-cache-')
+    atexit.register(shutil.rmtree, CACHE_DIR, True)
+    CACHES['default']['LOCATION'] = os.path.join(CACHE_DIR, 'cache.sqlite3')
+
+# Лента подписок: сколько подписчиков автора получают его посты при записи,
+# остальные подмешивают их при чтении
+FEED_FANOUT_LIMIT = 1000
+# сколько последних постов автора попадает в ленту при подписке
+FEED_BACKFILL_SIZE = 1000
+
+# сколько секунд живёт отрендеренная карточка поста в кэше
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# сколько секунд живёт страница, закэшированная для анонимных посетителей
+PAGE_CACHE_TIMEOUT = 60 * 5
+
+# размеры превью картинок постов: имя -> (геометрия sorl, опции);
+# шаблоны ссылаются на превью по имени, см. posts/thumbnails.py
+THUMBNAIL_SPECS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+# движок sorl с уменьшенным декодированием JPEG, см. posts/thumbnail_engine.py
+THUMBNAIL_ENGINE = 'posts.thumbnail_engine.Engine'
+
+# картинки постов: длинная сторона после загрузки и качество перекодирования,
+# см. posts/storage.py
+IMAGE_MAX_SIZE = 2560
+IMAGE_QUALITY = 85
+# имена медиафайлов неизменяемы, браузер может хранить их год
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+# варианты превью в компактных форматах, по убыванию предпочтения
+THUMBNAIL_VARIANT_FORMATS = ('AVIF', 'WEBP')
+# уменьшенные копии превью для srcset, строятся в фоне сразу после загрузки
+THUMBNAIL_SRCSET_WIDTHS = {'card': (320, 480, 640)}
+# в тестах выключено: поток строил бы превью, пока тест удаляет MEDIA_ROOT;
+# тесты самой сборки включают её через override_settings
+THUMBNAIL_PREBUILD = not TESTING
+# передача медиа фронт-серверу: None, 'X-Accel-Redirect' (nginx, internal
+# location MEDIA_ACCEL_PREFIX) или 'X-Sendfile', см. yatube/media.py
+MEDIA_SENDFILE_HEADER = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# расстояние Хэмминга между dHash, до которого загрузка считается копией
+# уже загруженной картинки, см. posts/dhash.py
+IMAGE_DUPLICATE_DISTANCE = 3
+# бюджет каталога превью sorl на диске, см. команду prune_thumbnails
+THUMBNAIL_CACHE_MAX_SIZE = 5 * 1024 ** 3
+# картинки og:image постов строятся в пуле процессов после сохранения поста,
+# см. posts/og_images.py
+# в тестах выключено: процесс пула не видит тестовую базу в памяти
+OG_IMAGES = not TESTING
+OG_IMAGE_WORKERS = 1
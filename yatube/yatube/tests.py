@@ -0,0 +1,240 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+from django.conf import settings
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.http import http_date
+
+from . import media
+from .sqlite_cache import SQLiteCache
+
+
+def make_cache(location, **options):
+    return SQLiteCache(location, {'OPTIONS': options})
+
+
+def incr_many(location, times):
+    cache = make_cache(location)
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    """Контракт бэкенда кэша Django для SQLiteCache."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = os.path.join(self.dir, 'cache.sqlite3')
+        self.cache = make_cache(self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_set_get_delete(self):
+        self.cache.set('key', {'a': [1, 2]})
+        self.assertEqual(self.cache.get('key'), {'a': [1, 2]})
+        self.assertTrue(self.cache.has_key('key'))
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_add_only_missing(self):
+        self.assertTrue(self.cache.add('key', 'first'))
+        self.assertFalse(self.cache.add('key', 'second'))
+        self.assertEqual(self.cache.get('key'), 'first')
+
+    def test_many(self):
+        self.cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(self.cache.get_many(['a', 'c', 'missing']),
+                         {'a': 1, 'c': 3})
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'c': 3})
+
+    def test_incr_decr(self):
+        self.cache.set('answer', 41)
+        self.assertEqual(self.cache.incr('answer'), 42)
+        self.assertEqual(self.cache.decr('answer', 10), 32)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_expiration(self):
+        self.cache.set('expired', 1, timeout=0.01)
+        self.cache.set('zero', 1, timeout=0)
+        self.cache.set('forever', 1, timeout=None)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertIsNone(self.cache.get('zero'))
+        self.assertEqual(self.cache.get('forever'), 1)
+        self.assertTrue(self.cache.add('expired', 2))
+        self.assertEqual(self.cache.get('expired'), 2)
+
+    def test_touch(self):
+        self.cache.set('key', 1, timeout=0.01)
+        self.assertTrue(self.cache.touch('key', timeout=None))
+        time.sleep(0.02)
+        self.assertEqual(self.cache.get('key'), 1)
+        self.assertFalse(self.cache.touch('missing'))
+
+    def test_versions_and_clear(self):
+        self.cache.set('key', 'v1', version=1)
+        self.cache.set('key', 'v2', version=2)
+        self.assertEqual(self.cache.get('key', version=1), 'v1')
+        self.assertEqual(self.cache.get('key', version=2), 'v2')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key', version=1))
+
+    def test_lru_eviction(self):
+        cache = make_cache(self.location, MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        for key in 'abc':
+            cache.set(key, key)
+        cache._db.execute("UPDATE cache SET accessed = 0 WHERE key LIKE '%a'")
+        cache.set('d', 'd')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get_many(['b', 'c', 'd']),
+                         {'b': 'b', 'c': 'c', 'd': 'd'})
+
+    def test_shared_between_instances(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(make_cache(self.location).get('key'), 'value')
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(),
+                         'нужен fork')
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=incr_many,
+                                   args=(self.location, 50))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+    def test_tests_do_not_use_shared_cache_file(self):
+        """Тесты чистят кэш в своём файле, а не в cache.sqlite3."""
+        self.assertNotEqual(
+            os.path.dirname(settings.CACHES['default']['LOCATION']),
+            settings.BASE_DIR,
+        )
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+CONTENT = bytes(range(100))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MediaServingTests(SimpleTestCase):
+    """Отдача медиа через MediaMiddleware."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.makedirs(os.path.join(MEDIA_ROOT, 'posts'), exist_ok=True)
+        with open(os.path.join(MEDIA_ROOT, 'posts', 'a.jpg'), 'wb') as file:
+            file.write(CONTENT)
+        cls.url = '/media/posts/a.jpg'
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['ETag'])
+
+    def test_not_modified(self):
+        """Условный запрос получает 304 без открытия файла."""
+        response = self.client.get(self.url)
+        with mock.patch.object(media, 'open', create=True) as opened:
+            by_etag = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            by_date = self.client.get(
+                self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        opened.assert_not_called()
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_etag['ETag'], response['ETag'])
+        self.assertEqual(by_date.status_code, 304)
+
+    def test_ranges(self):
+        for header, start, end in (('bytes=10-19', 10, 19),
+                                   ('bytes=90-', 90, 99),
+                                   ('bytes=-5', 95, 99),
+                                   ('bytes=95-500', 95, 99)):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b''.join(response.streaming_content),
+                                 CONTENT[start:end + 1])
+                self.assertEqual(response['Content-Range'],
+                                 f'bytes {start}-{end}/{len(CONTENT)}')
+                self.assertEqual(response['Content-Length'],
+                                 str(end - start + 1))
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(CONTENT)}')
+        # ошибка запроса не кэшируется на год
+        self.assertNotIn('Cache-Control', response)
+        for header in ('bytes=1-2,5-6', 'lines=1-2', 'bytes=5-1'):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 200)
+
+    def test_if_range(self):
+        """Диапазон отдаётся, только если файл не менялся."""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9',
+                                   HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9',
+                                   HTTP_IF_RANGE=http_date(0))
+        self.assertEqual(response.status_code, 200)
+
+    def test_front_server_offload(self):
+        for header, value in (
+                ('X-Accel-Redirect', '/protected-media/posts/a.jpg'),
+                ('X-Sendfile', os.path.join(MEDIA_ROOT, 'posts', 'a.jpg'))):
+            with self.subTest(header=header), \
+                    mock.patch.object(media, 'MEDIA_SENDFILE_HEADER', header):
+                response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response[header], value)
+                self.assertEqual(response.content, b'')
+                self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_outside_media_root(self):
+        request = RequestFactory().get('/media/../settings.py')
+        for name in ('../settings.py', 'posts', 'posts/missing.jpg'):
+            with self.subTest(name=name), self.assertRaises(Http404):
+                media.serve_file(request, name)
+
+    def test_only_get_and_head(self):
+        self.assertEqual(self.client.head(self.url).status_code, 200)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_access_time_refreshed(self):
+        """Доступ отмечается в atime, mtime и ETag не меняются."""
+        path = os.path.join(MEDIA_ROOT, 'posts', 'a.jpg')
+        etag = self.client.get(self.url)['ETag']
+        mtime = os.stat(path).st_mtime_ns
+        os.utime(path, ns=(0, mtime))
+        self.assertEqual(self.client.get(self.url)['ETag'], etag)
+        file_stat = os.stat(path)
+        self.assertGreater(file_stat.st_atime, time.time() - 60)
+        self.assertEqual(file_stat.st_mtime_ns, mtime)
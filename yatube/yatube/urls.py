@@ -19,6 +19,8 @@ from django.conf.urls import handler404, handler500  # noqa
 from django.conf import settings
 from django.conf.urls.static import static
 
+from posts.url_dispatch import compiled_path
+
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
@@ -27,12 +29,12 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
-    path("", include("posts.urls")),
+    # маршруты постов разбираются деревом сегментов, см. posts/url_dispatch.py
+    compiled_path("", include("posts.urls")),
 
 ]
 
+# медиа отдаёт yatube.media.MediaMiddleware, в том числе без DEBUG
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL,
                           document_root=settings.STATIC_ROOT)